@@ -14,6 +14,12 @@ def create_app(config: dict[str, str | float] | None = None) -> Flask:
     if config:
         app.config.from_mapping(config)
 
+    from .json_provider import JSONProvider
+    app.json = JSONProvider(app)
+
+    from .compression import compress_response
+    app.after_request(compress_response)
+
     from .model import db, migrate
     db.init_app(app)
     migrate.init_app(app, db)
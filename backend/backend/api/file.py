@@ -1,26 +1,112 @@
-from typing import cast
+import datetime
+import itertools
+import pathlib
+import secrets
+from collections.abc import Iterable, Iterator, Sequence
+from typing import NoReturn, cast
 
-from flask import abort, request, send_file
+from flask import Response, abort, current_app, make_response, request
 from flask.typing import ResponseReturnValue
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.sansio import multipart
+from werkzeug.wsgi import wrap_file
 
 from backend.model import db
-from backend.model.file import EXTENSIONS, File
+from backend.model.file import EXTENSIONS, File, get_upload_path
 from backend.model.user import Role
 
 from . import api
 from .auth import Authable, auth
+from .rate_limit import rate_limited
+
+CHUNK_SIZE = 64 * 1024
+# Plenty for a file and a few other fields, which are ignored
+MAX_FORM_PARTS = 10
+
+
+def abort_too_large() -> NoReturn:
+    abort(make_response({'message': 'file_too_large'}, 413))
+
+
+def read_body(max_size: int) -> Iterator[bytes]:
+    size = 0
+
+    while chunk := request.stream.read(CHUNK_SIZE):
+        size += len(chunk)
+
+        # Content-Length may be missing, e.g. for chunked requests
+        if size > max_size:
+            abort_too_large()
+
+        yield chunk
+
+
+def read_form_events(body: Iterable[bytes]) -> Iterator[multipart.Event]:
+    boundary = request.mimetype_params.get('boundary')
+
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        abort(400, 'expected_file')
+
+    decoder = multipart.MultipartDecoder(
+        boundary.encode(),
+        max_parts=MAX_FORM_PARTS,
+    )
+
+    # None tells the decoder the body is complete
+    for chunk in itertools.chain(body, [None]):
+        decoder.receive_data(chunk)
+
+        while True:
+            try:
+                event = decoder.next_event()
+
+            except ValueError:
+                abort(400, 'expected_file')
+
+            if isinstance(event, (multipart.NeedData, multipart.Epilogue)):
+                break
+
+            yield event
+
+
+def read_file_data(events: Iterator[multipart.Event]) -> Iterator[bytes]:
+    for event in events:
+        assert isinstance(event, multipart.Data)
+        yield event.data
+
+        if not event.more_data:
+            return
+
+
+def stream_upload(name: str) -> tuple[str, Iterator[bytes]]:
+    events = read_form_events(read_body(current_app.config['FILES_MAX_SIZE']))
+
+    for event in events:
+        if isinstance(event, multipart.File) and event.name == name:
+            return event.filename, read_file_data(events)
+
+    abort(400, 'expected_file')
 
 
 @api.post('/files')
 @auth.login_required(role=(Role.ADMINISTRATOR, Role.USER))
+@rate_limited('files')
 def upload_file() -> ResponseReturnValue:
-    upload = request.files.get('file')
+    # Rejected before reading any of it
+    if (request.content_length or 0) > current_app.config['FILES_MAX_SIZE']:
+        abort_too_large()
 
-    if not upload:
-        abort(400, 'expected_file')
+    file = File.from_upload(*stream_upload('file'))
+    upload_path = get_upload_path(file.path)
 
-    file = File.from_upload(upload)
-    db.session.commit()
+    try:
+        db.session.commit()
+
+    # Renamed into place on commit only
+    except Exception:
+        upload_path.unlink(missing_ok=True)
+        raise
 
     return {'filename': file.filename}, 201
 
@@ -47,11 +133,168 @@ EXTENSION_TO_MIMETYPE = {
 }
 
 
+def get_byte_ranges(size: int) -> list[tuple[int, int]] | None:
+    # Unordered or overlapping ranges are invalid to werkzeug, invalid and
+    # unsupported ranges are ignored as allowed by RFC 9110
+    ranges = request.range
+
+    if ranges is None or ranges.units != 'bytes':
+        return None
+
+    byte_ranges = []
+
+    for start, stop in ranges.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+
+        else:
+            stop = size if stop is None else min(stop, size)
+
+        if start < stop:
+            byte_ranges.append((start, stop))
+
+    if not byte_ranges:
+        raise RequestedRangeNotSatisfiable(length=size)
+
+    return byte_ranges
+
+
+def read_ranges(
+    path: pathlib.Path,
+    ranges: Sequence[tuple[int, int]],
+    parts: Sequence[bytes] = (),
+    end: bytes = b'',
+) -> Iterator[bytes]:
+    with path.open('rb') as stream:
+        for index, (start, stop) in enumerate(ranges):
+            if parts:
+                yield parts[index]
+
+            stream.seek(start)
+
+            while start < stop:
+                chunk = stream.read(min(CHUNK_SIZE, stop - start))
+
+                if not chunk:
+                    break
+
+                start += len(chunk)
+                yield chunk
+
+    if end:
+        yield end
+
+
+def send_ranges(
+    response: Response,
+    path: pathlib.Path,
+    ranges: Sequence[tuple[int, int]],
+    size: int,
+) -> Response:
+    response.status_code = 206
+
+    if len(ranges) == 1:
+        (start, stop), = ranges
+        response.content_range = f'bytes {start}-{stop - 1}/{size}'
+        response.content_length = stop - start
+        parts: list[bytes] = []
+        end = b''
+
+    else:
+        boundary = secrets.token_hex(16)
+        parts = [
+            (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {response.mimetype}\r\n'
+                f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+            ).encode()
+            for start, stop in ranges
+        ]
+        end = f'\r\n--{boundary}--\r\n'.encode()
+        response.content_type = f'multipart/byteranges; boundary={boundary}'
+        response.content_length = sum(
+            len(part) + stop - start
+            for part, (start, stop) in zip(parts, ranges)
+        ) + len(end)
+
+    if request.method != 'HEAD':
+        response.response = read_ranges(path, ranges, parts, end)
+
+    return response
+
+
 @api.get('/files/<file:file>')
 def download_file(file: File) -> ResponseReturnValue:
     path = file.path
     mimetype = EXTENSION_TO_MIMETYPE[path.suffix[1:]]
-    # Send an open file to let frontend pick a filename, see note in:
+    config = current_app.config
+
+    # Sent by nginx, the worker is done once headers are out
+    if config['FILES_DOWNLOAD_MODE'] == 'x-accel-redirect':
+        return Response(mimetype=mimetype, headers={
+            'X-Accel-Redirect': (
+                f'{config["FILES_ACCEL_LOCATION"]}/{file.filename}'
+            ),
+        })
+
+    # No Content-Disposition, to let frontend pick a filename, see note in:
     # https://developer.mozilla.org/en-US/docs/Web/HTML/Element/a#download
-    # Flask would otherwise auto-populate the filename header
-    return send_file(path.resolve().open('rb'), mimetype=mimetype)
+    path = path.resolve()
+    stat = path.stat()
+    size = stat.st_size
+
+    # Only unknown for files uploaded before it was recorded, the digest
+    # wouldn't match the content either
+    if file.size is not None and file.size != size:
+        current_app.logger.error(
+            'Size of %s is %d bytes, %d were uploaded',
+            path,
+            size,
+            file.size,
+        )
+        abort(500)
+
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    # Filenames are never reused either, their size only guards against
+    # bad writes
+    response.set_etag(file.sha256 or f'{file.filename}-{size}')
+    # HTTP dates don't go below seconds
+    last_modified = datetime.datetime.fromtimestamp(
+        int(stat.st_mtime),
+        datetime.UTC,
+    )
+    response.last_modified = last_modified
+    response.accept_ranges = 'bytes'
+    response.cache_control.no_cache = True
+    etag, _ = response.get_etag()
+
+    if not is_resource_modified(
+        request.environ,
+        etag,
+        last_modified=last_modified,
+    ):
+        response.status_code = 412 if request.if_match else 304
+        return response
+
+    # Whole file instead, when changed since the If-Range validator
+    if size and 'Range' in request.headers and (
+        'If-Range' not in request.headers
+        or not is_resource_modified(
+            request.environ,
+            etag,
+            last_modified=last_modified,
+            ignore_if_range=False,
+        )
+    ):
+        ranges = get_byte_ranges(size)
+
+        if ranges is not None:
+            return send_ranges(response, path, ranges, size)
+
+    response.content_length = size
+
+    # Nothing to open for HEAD requests
+    if request.method != 'HEAD':
+        response.response = wrap_file(request.environ, path.open('rb'))
+
+    return response
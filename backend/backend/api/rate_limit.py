@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import fcntl
+import functools
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Callable, Sequence
+from typing import ParamSpec, Protocol, cast
+
+from flask import abort, current_app, make_response, request
+from flask.typing import ResponseReturnValue
+from sqlalchemy import Engine, func
+from sqlalchemy.dialects.postgresql import insert
+
+from backend.model import db
+from backend.model.rate_limit import RateLimitBucket
+
+from .auth import Authable, auth
+
+P = ParamSpec('P')
+# Key hash, tokens and update time
+SLOT = struct.Struct('=Qdd')
+
+
+class Buckets(Protocol):
+    # Takes from all buckets or none, returning seconds to wait before
+    # another try when none
+    def take(
+        self,
+        keys: Sequence[str],
+        burst: float,
+        rate: float,
+        cost: float = 1,
+    ) -> float: ...
+
+
+class RateLimited(Exception):
+    pass
+
+
+def refill(tokens: float, elapsed: float, burst: float, rate: float) -> float:
+    # Clocks going backwards don't take tokens away
+    return min(burst, tokens + max(elapsed, 0) * rate)
+
+
+def get_required_tokens(burst: float, cost: float) -> float:
+    # Costs over the burst take a full bucket, leaving it in debt
+    return min(burst, cost)
+
+
+class SharedBuckets:
+    def __init__(self, path: str, slots: int) -> None:
+        self.slots = slots
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * SLOT.size
+
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+
+        self.memory = mmap.mmap(self.fd, size)
+        # Record locks don't exclude threads of the same process
+        self.lock = threading.Lock()
+
+    def get_slot(self, key: str) -> tuple[int, int]:
+        digest = int.from_bytes(
+            hashlib.blake2b(key.encode(), digest_size=8).digest(),
+            'little',
+        )
+        return digest, digest % self.slots * SLOT.size
+
+    def take(
+        self,
+        keys: Sequence[str],
+        burst: float,
+        rate: float,
+        cost: float = 1,
+    ) -> float:
+        slots = [self.get_slot(key) for key in keys]
+        required = get_required_tokens(burst, cost)
+
+        with self.lock:
+            # Record locks belong to the process, even when the fd was
+            # inherited
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+
+            try:
+                now = time.time()
+                buckets = []
+
+                for digest, offset in slots:
+                    stored_digest, tokens, update_time = SLOT.unpack_from(
+                        self.memory,
+                        offset,
+                    )
+                    buckets.append(
+                        refill(tokens, now - update_time, burst, rate)
+                        if stored_digest == digest else burst
+                    )
+
+                lowest = min(buckets)
+                taken = cost if lowest >= required else 0
+
+                for (digest, offset), tokens in zip(slots, buckets):
+                    SLOT.pack_into(
+                        self.memory,
+                        offset,
+                        digest,
+                        tokens - taken,
+                        now,
+                    )
+
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+        return 0 if taken else (required - lowest) / rate
+
+
+class DatabaseBuckets:
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+
+    def take(
+        self,
+        keys: Sequence[str],
+        burst: float,
+        rate: float,
+        cost: float = 1,
+    ) -> float:
+        required = get_required_tokens(burst, cost)
+        now = func.extract('epoch', func.clock_timestamp())
+        tokens = func.least(
+            burst,
+            RateLimitBucket.tokens + func.greatest(
+                now - RateLimitBucket.update_time,
+                0,
+            ) * rate,
+        )
+
+        try:
+            with self.engine.begin() as connection:
+                # Same locking order for everyone, avoiding deadlocks
+                for key in sorted(keys):
+                    taken = connection.execute(
+                        insert(RateLimitBucket)
+                        .values(
+                            key=key,
+                            tokens=burst - cost,
+                            update_time=now,
+                        )
+                        .on_conflict_do_update(
+                            index_elements=[RateLimitBucket.key],
+                            set_={'tokens': tokens - cost, 'update_time': now},
+                            where=tokens >= required,
+                        )
+                        .returning(RateLimitBucket.key)
+                    ).first()
+
+                    if taken is None:
+                        raise RateLimited
+
+        # Rolled back, buckets are left untouched
+        except RateLimited:
+            # Remaining tokens are unknown, buckets in debt take longer
+            return required / rate
+
+        return 0
+
+
+def create_buckets(storage: str) -> Buckets:
+    config = current_app.config
+
+    if storage == 'shared':
+        return SharedBuckets(
+            config['RATE_LIMIT_SHARED_PATH'],
+            config['RATE_LIMIT_SHARED_SLOTS'],
+        )
+
+    if storage == 'database':
+        return DatabaseBuckets(db.engine)
+
+    raise ValueError(f'Unknown RATE_LIMIT_STORAGE: {storage}')
+
+
+def get_buckets() -> Buckets | None:
+    storage = current_app.config['RATE_LIMIT_STORAGE']
+
+    if not storage:
+        return None
+
+    # Created on first use, after uwsgi forked the workers
+    buckets: dict[str, Buckets] = current_app.extensions.setdefault(
+        'rate_limit_buckets',
+        {},
+    )
+
+    if storage not in buckets:
+        buckets[storage] = create_buckets(storage)
+
+    return buckets[storage]
+
+
+def check_rate_limit(name: str, cost: float = 1) -> None:
+    config = current_app.config
+    burst = config[f'RATE_LIMIT_{name.upper()}_BURST']
+    buckets = get_buckets()
+
+    if not burst or buckets is None:
+        return
+
+    auth_info = cast(Authable, auth.current_user()).get_auth_info()
+    delay = buckets.take(
+        [
+            f'{name}:user:{auth_info["id"] or auth_info["email"]}',
+            f'{name}:address:{request.remote_addr}',
+        ],
+        burst,
+        config[f'RATE_LIMIT_{name.upper()}_RATE'],
+        cost,
+    )
+
+    if delay:
+        abort(make_response(
+            {'message': 'rate_limited'},
+            429,
+            {'Retry-After': str(math.ceil(delay))},
+        ))
+
+
+def rate_limited(name: str) -> Callable[
+    [Callable[P, ResponseReturnValue]],
+    Callable[P, ResponseReturnValue],
+]:
+    def decorator(
+        view: Callable[P, ResponseReturnValue],
+    ) -> Callable[P, ResponseReturnValue]:
+        @functools.wraps(view)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> ResponseReturnValue:
+            check_rate_limit(name)
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -7,7 +7,12 @@ from marshmallow import Schema, fields
 
 from backend.model import db
 from backend.model.user import Role, User
-from backend.schema import CreateSchema, EmptySchema
+from backend.schema import (
+    CreateSchema,
+    EmptySchema,
+    get_dump_plan,
+    get_schema,
+)
 from backend.schema.user import UserSchema
 
 from . import api
@@ -18,7 +23,7 @@ from .auth import auth
 @api.post('/users')
 @auth.login_required(role=Role.ADMINISTRATOR)
 def create_user() -> ResponseReturnValue:
-    user = UserSchema().load(request.json)
+    user = cast(User, get_schema(UserSchema).load(request.json))
 
     User.check_duplicate(user)
 
@@ -46,7 +51,7 @@ def update_user(user: User) -> ResponseReturnValue:
         partial=True,
     )
     db.session.commit()
-    return jsonify(UserSchema().dump(user))
+    return jsonify(get_dump_plan(UserSchema).dump(user))
 
 
 @open_api.get_list(UserSchema)
@@ -54,14 +59,14 @@ def update_user(user: User) -> ResponseReturnValue:
 @auth.login_required(role=Role.ADMINISTRATOR)
 def list_users() -> ResponseReturnValue:
     users = User.query.order_by(User.creation_date)
-    return {'users': UserSchema(many=True).dump(users)}
+    return {'users': get_dump_plan(UserSchema).dump_many(users)}
 
 
 @open_api.get(UserSchema)
 @api.get('/users/<user:user>')
 @auth.login_required(role=Role.ADMINISTRATOR)
 def get_user(user: User) -> ResponseReturnValue:
-    return jsonify(UserSchema().dump(user))
+    return jsonify(get_dump_plan(UserSchema).dump(user))
 
 
 @open_api.get(EmptySchema, operation_id='get_password_state')
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import importlib.util
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+from typing import Protocol
+
+from flask import Response, current_app, request
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'text/event-stream',
+    'text/html',
+    'text/plain',
+}
+STREAMED_MIMETYPES = {'text/event-stream'}
+HAS_BROTLI = importlib.util.find_spec('brotli') is not None
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes) -> bytes: ...
+
+    # Whatever was compressed so far, readable by the client as is
+    def flush(self) -> bytes: ...
+
+    def finish(self) -> bytes: ...
+
+
+class ZlibCompressor:
+    def __init__(self, wbits: int) -> None:
+        self.compressor = zlib.compressobj(wbits=wbits)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self) -> None:
+        import brotli  # type: ignore
+
+        # Default quality is meant for static assets, far too slow here
+        self.compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data: bytes) -> bytes:
+        return bytes(self.compressor.process(data))
+
+    def flush(self) -> bytes:
+        return bytes(self.compressor.flush())
+
+    def finish(self) -> bytes:
+        return bytes(self.compressor.finish())
+
+
+COMPRESSORS: dict[str, Callable[[], Compressor]] = {
+    'gzip': lambda: ZlibCompressor(16 + zlib.MAX_WBITS),
+    # Zlib wrapped, as "deflate" means in HTTP
+    'deflate': lambda: ZlibCompressor(zlib.MAX_WBITS),
+}
+
+if HAS_BROTLI:  # pragma: no cover
+    COMPRESSORS['br'] = BrotliCompressor
+
+
+def get_encoding() -> str | None:
+    return request.accept_encodings.best_match([
+        encoding
+        for encoding in current_app.config['COMPRESSION_ENCODINGS']
+        if encoding in COMPRESSORS
+    ])
+
+
+def compress_stream(
+    body: Iterable[bytes | str],
+    compressor: Compressor,
+) -> Iterator[bytes]:
+    try:
+        for chunk in body:
+            if chunk:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+
+                yield compressor.compress(chunk) + compressor.flush()
+
+        yield compressor.finish()
+
+    # Ends the wrapped stream too, e.g. when the client went away
+    finally:
+        if close := getattr(body, 'close', None):
+            close()
+
+
+def compress_response(response: Response) -> Response:
+    if (
+        request.method == 'HEAD'
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    streamed = response.mimetype in STREAMED_MIMETYPES
+
+    if not streamed and (
+        response.is_streamed
+        or len(response.get_data())
+        < current_app.config['COMPRESSION_MIN_SIZE']
+    ):
+        return response
+
+    # Whether compressed or not, caches must tell encodings apart
+    response.vary.add('Accept-Encoding')
+    encoding = get_encoding()
+
+    if not encoding:
+        return response
+
+    compressor = COMPRESSORS[encoding]()
+
+    if streamed:
+        response.response = compress_stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+
+    else:
+        response.set_data(
+            compressor.compress(response.get_data()) + compressor.finish(),
+        )
+
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -10,6 +10,11 @@ db_name = getenv('DB_NAME', db_user)
 SQLALCHEMY_DATABASE_URI = (
     f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
 )
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(getenv('DB_POOL_SIZE', 5)),
+    'max_overflow': int(getenv('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(getenv('DB_POOL_TIMEOUT', 30)),
+}
 SECRET_KEY = getenv('SECRET_KEY')
 ADMIN_PASSWORD = getenv('ADMIN_PASSWORD')
 ENABLE_DOCS = getenv('ENABLE_DOCS')
@@ -19,4 +24,40 @@ EMAIL_HOST_USER = getenv('EMAIL_HOST_USER', 'dev@localhost')
 EMAIL_HOST_PASSWORD = getenv('EMAIL_HOST_PASSWORD', '')
 EMAIL_USE_TLS = bool(getenv('EMAIL_USE_TLS', False))
 EMAIL_USE_SSL = bool(getenv('EMAIL_USE_SSL', False))
-STREAM_REFRESH_INTERVAL = float(getenv('STREAM_REFRESH_INTERVAL', 1))
+STREAM_KEEP_ALIVE = float(getenv('STREAM_KEEP_ALIVE', 15))
+STREAM_BACKLOG_SIZE = int(getenv('STREAM_BACKLOG_SIZE', 100))
+STREAM_HIGH_WATER_MARK = int(getenv('STREAM_HIGH_WATER_MARK', 64))
+STREAM_RETRY_INTERVAL = int(getenv('STREAM_RETRY_INTERVAL', 5000))
+STREAM_COALESCE_WINDOW = float(getenv('STREAM_COALESCE_WINDOW', .02))
+MESSAGES_BROKER_SOCKET = getenv('MESSAGES_BROKER_SOCKET')
+MESSAGE_PARTITIONING = bool(getenv('MESSAGE_PARTITIONING', False))
+MESSAGE_PARTITIONS_AHEAD = int(getenv('MESSAGE_PARTITIONS_AHEAD', 3))
+MESSAGE_RETENTION_MONTHS = int(getenv('MESSAGE_RETENTION_MONTHS', 0))
+MESSAGE_NOTIFY_TRIGGER = bool(getenv('MESSAGE_NOTIFY_TRIGGER', False))
+LISTENER_RECONNECT_DELAY = float(getenv('LISTENER_RECONNECT_DELAY', .5))
+# Also how long listeners stay connected before the delay is reset
+LISTENER_RECONNECT_MAX_DELAY = float(
+    getenv('LISTENER_RECONNECT_MAX_DELAY', 30),
+)
+# send_file or x-accel-redirect (nginx, see nginx.conf.template)
+FILES_DOWNLOAD_MODE = getenv('FILES_DOWNLOAD_MODE', 'send_file')
+FILES_ACCEL_LOCATION = getenv('FILES_ACCEL_LOCATION', '/internal/files')
+# In bytes, same as client_max_body_size in docker-compose.yml
+FILES_MAX_SIZE = int(getenv('FILES_MAX_SIZE', 10 * 1024 * 1024))
+RATE_LIMIT_STORAGE = getenv('RATE_LIMIT_STORAGE', 'shared')
+RATE_LIMIT_SHARED_PATH = getenv(
+    'RATE_LIMIT_SHARED_PATH',
+    '/dev/shm/fluxt-rate-limits',
+)
+RATE_LIMIT_SHARED_SLOTS = int(getenv('RATE_LIMIT_SHARED_SLOTS', 65536))
+# Requests at once and refilled per second, no burst disables the limit
+RATE_LIMIT_MESSAGES_BURST = float(getenv('RATE_LIMIT_MESSAGES_BURST', 20))
+RATE_LIMIT_MESSAGES_RATE = float(getenv('RATE_LIMIT_MESSAGES_RATE', 2))
+RATE_LIMIT_FILES_BURST = float(getenv('RATE_LIMIT_FILES_BURST', 5))
+RATE_LIMIT_FILES_RATE = float(getenv('RATE_LIMIT_FILES_RATE', .2))
+# In order of preference, br needs the brotli package
+COMPRESSION_ENCODINGS = getenv(
+    'COMPRESSION_ENCODINGS',
+    'br,gzip,deflate',
+).split(',')
+COMPRESSION_MIN_SIZE = int(getenv('COMPRESSION_MIN_SIZE', 1024))
@@ -31,5 +31,7 @@ def validation_error(error: ValidationError) -> ResponseReturnValue:
 
 
 from . import (  # noqa: F401, E402
+    broker,
     messages,
+    partitions,
 )
@@ -0,0 +1,122 @@
+import contextlib
+import json
+import os
+import socket
+from typing import cast
+
+import click
+import gevent
+import gevent.queue
+import gevent.socket
+from flask import Flask, current_app
+from gevent.server import StreamServer
+
+from . import api
+from .messages import BroadcastHub, MessageEvent, listen_notifications
+
+# Payloads queued for a worker before it gets disconnected, it then catches
+# up from the database when reconnecting
+RELAY_QUEUE_SIZE = 1024
+
+
+class Relay:
+    def __init__(self) -> None:
+        self.queue: gevent.queue.Queue[str] = gevent.queue.Queue(
+            maxsize=RELAY_QUEUE_SIZE,
+        )
+        self.greenlet = gevent.getcurrent()
+
+    def push(self, payload: str) -> bool:
+        try:
+            self.queue.put_nowait(payload)
+
+        except gevent.queue.Full:
+            return False
+
+        return True
+
+    def run(self, connection: socket.socket) -> None:
+        while True:
+            connection.sendall(f'{self.queue.get()}\n'.encode())
+
+
+class RelayHub(BroadcastHub):
+    def __init__(self) -> None:
+        super().__init__()
+        self.relays: set[Relay] = set()
+
+    def serve(self, connection: socket.socket, _: object) -> None:
+        relay = Relay()
+        self.relays.add(relay)
+        writer = gevent.spawn(relay.run, connection)
+
+        try:
+            # Workers never send anything, this returns once they're gone
+            connection.recv(1)
+
+        finally:
+            writer.kill()
+            self.relays.discard(relay)
+            connection.close()
+
+    def relay(self, payload: str) -> None:
+        for relay in tuple(self.relays):
+            if not relay.push(payload):
+                self.relays.discard(relay)
+                gevent.kill(relay.greenlet)
+
+    def broadcast(self, events: list[MessageEvent] | None) -> None:
+        super().broadcast(events)
+
+        if events is None:
+            # Workers catch up from the database
+            self.relay('')
+            return
+
+        self.relay(json.dumps({'events': [
+            [
+                message_event.id,
+                message_event.date.isoformat(),
+                message_event.frame.decode(),
+                message_event.kind,
+                message_event.channel,
+            ]
+            for message_event in events
+        ]}))
+
+    def invalidate_authors(self, author_ids: list[str]) -> None:
+        super().invalidate_authors(author_ids)
+        self.relay(json.dumps({'authors': author_ids}))
+
+
+def bind_broker_socket(path: str) -> socket.socket:
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+    listener = gevent.socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    return listener
+
+
+@api.cli.command(
+    'broker',
+    help='Relay message notifications to the workers of this node.',
+)
+def run_broker() -> None:
+    app = cast(Flask, current_app._get_current_object())  # type: ignore
+    path = app.config['MESSAGES_BROKER_SOCKET']
+
+    if not path:
+        raise click.UsageError('MESSAGES_BROKER_SOCKET is not set.')
+
+    relay_hub = RelayHub()
+    server = StreamServer(bind_broker_socket(path), relay_hub.serve)
+    server.start()
+
+    try:
+        # The broker itself always LISTENs on the database
+        listen_notifications(app, relay_hub, None)
+
+    finally:
+        server.stop()
@@ -1,156 +1,959 @@
 from __future__ import annotations
 
+import collections
 import datetime
-from collections.abc import Generator
-from typing import cast
+import itertools
+import json
+import operator
+import os
+import socket
+import time
+import uuid
+from collections.abc import Generator, Iterable
+from typing import Any, NamedTuple, Protocol, cast
 
 import gevent
 import gevent.queue
-from flask import Response, current_app, request, stream_with_context
+import gevent.socket
+from flask import (
+    Flask,
+    Response,
+    abort,
+    current_app,
+    request,
+    stream_with_context,
+)
 from flask.typing import ResponseReturnValue
-from marshmallow import Schema, fields
-from marshmallow.validate import Length
-from sqlalchemy import event, select, text
-from sqlalchemy.orm import Session
+from gevent.socket import wait_read
+from marshmallow import Schema, ValidationError, fields
+from marshmallow.validate import Length, Range, Regexp
+from sqlalchemy import (
+    REAL,
+    ColumnElement,
+    Select,
+    String,
+    and_,
+    delete,
+    func,
+    insert,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy import (
+    cast as sql_cast,
+)
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.orm.interfaces import LoaderOption
 
 from backend.api.auth import auth
+from backend.api.rate_limit import check_rate_limit, rate_limited
 from backend.model import db
+from backend.model.changes import ChangeFeed, Changes
 from backend.model.superadmin import SuperAdmin
 from backend.model.user import Role, User
+from backend.schema import get_dump_plan
 
 from . import api
-from .model.message import Message
+from .model.message import (
+    CHANNEL_MAX_LENGTH,
+    DEFAULT_CHANNEL,
+    SEARCH_CONFIG,
+    Message,
+    MessageInfo,
+)
 
 MESSAGES_CHANNEL = 'messages'
-SESSION_MESSAGES_CHANGED_KEY = 'messages_changed'
-subscriber_queues: set[gevent.queue.Queue[None]] = set()
-listener_greenlet: gevent.Greenlet[[], None] | None = None
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 8000
+# Message IDs per notification, keeps payloads below NOTIFY_PAYLOAD_LIMIT
+NOTIFY_IDS_CHUNK_SIZE = 150
+# Recent events kept per worker to resume streams from Last-Event-ID
+REPLAY_BUFFER_SIZE = 1024
+# Recent message IDs kept per stream to skip those already sent
+SENT_IDS_SIZE = 1024
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+AUTHOR_NAMES_CACHE_SIZE = 4096
+BATCH_MAX_SIZE = 1000
+SEARCH_QUERY_MAX_LENGTH = 200
+SEARCH_HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2'
+CHANNEL_PATTERN = rf'^[a-z0-9][a-z0-9_-]{{0,{CHANNEL_MAX_LENGTH - 1}}}\Z'
+# Stream event types
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+# Older messages were left out of a catch up, see catch_up_events
+GAP = 'gap'
+
+
+class MessageEvent(NamedTuple):
+    id: str
+    # Only created events move the stream cursor, see render_events
+    date: datetime.datetime
+    frame: bytes
+    kind: str = CREATED
+    channel: str = DEFAULT_CHANNEL
+
+    @property
+    def data(self) -> bytes:
+        # Frames are rendered by render_frame
+        return self.frame[
+            self.frame.index(b'\ndata: ') + len('\ndata: '):-len('\n\n')
+        ]
+
+
+class Notification(NamedTuple):
+    payload: str
+
+
+class NotificationConnection(Protocol):
+    notifies: list[Notification]
+
+    def fileno(self) -> int: ...
+
+    def poll(self) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class BrokerConnection:
+    def __init__(self, path: str) -> None:
+        self.socket = gevent.socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.buffer = b''
+        self.notifies: list[Notification] = []
+
+        try:
+            self.socket.connect(path)
+
+        except OSError:
+            self.socket.close()
+            raise
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def poll(self) -> None:
+        data = self.socket.recv(65536)
+
+        if not data:
+            raise ConnectionError('Message broker closed the connection')
+
+        *lines, self.buffer = (self.buffer + data).split(b'\n')
+        self.notifies.extend(Notification(line.decode()) for line in lines)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+class Subscriber:
+    def __init__(
+        self,
+        high_water_mark: int,
+        channel: str = DEFAULT_CHANNEL,
+    ) -> None:
+        self.channel = channel
+        self.queue: gevent.queue.Queue[list[MessageEvent]] = (
+            gevent.queue.Queue(maxsize=high_water_mark)
+        )
+        # Set when events may have been missed, the stream then catches up
+        # from the database before handling queued events
+        self.gap = False
+        # Set when the client fell too far behind, the stream then ends
+        self.evicted = False
+        # Set by the heartbeat ticker when the stream has been idle
+        self.heartbeat = False
+        self.active = time.monotonic()
+
+    def push(self, events: list[MessageEvent] | None) -> bool:
+        if events is None:
+            self.gap = True
+            events = []
+
+        try:
+            self.queue.put_nowait(events)
+
+        except gevent.queue.Full:
+            self.evicted = True
+
+            # Never sent now, don't keep them around
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+            # Wake up the stream if it's waiting
+            self.queue.put_nowait([])
+            return False
+
+        return True
+
+    def coalesce(
+        self,
+        events: list[MessageEvent],
+        window: float,
+    ) -> list[MessageEvent]:
+        events = list(events)
+        deadline = time.monotonic() + window
+
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                events += self.queue.get(timeout=remaining)
+
+            except gevent.queue.Empty:
+                break
+
+        return events
+
+
+# Messages can share a date, their ID breaks ties so none is skipped
+class StreamCursor:
+    def __init__(self) -> None:
+        self.date = datetime.datetime.min
+        # Canonical UUID strings sort like the database UUIDs
+        self.id = str(uuid.UUID(int=0))
+        # Insertion ordered, oldest first
+        self.sent: dict[str, None] = {}
+
+    def advance(self, message_id: str, date: datetime.datetime) -> bool:
+        if (date, message_id) <= (self.date, self.id):
+            return False
+
+        self.date = date
+        self.id = message_id
+        return True
+
+    def send(self, message_id: str, date: datetime.datetime) -> bool:
+        # Dates are transaction start times, a message committed late can
+        # come after the cursor went past it
+        if message_id in self.sent:
+            return False
+
+        self.sent[message_id] = None
+
+        if len(self.sent) > SENT_IDS_SIZE:
+            del self.sent[next(iter(self.sent))]
+
+        self.advance(message_id, date)
+        return True
+
+    def after(self) -> ColumnElement[bool]:
+        return and_(
+            # Lets Postgres skip older partitions, see partitions.py
+            Message.date >= self.date,
+            tuple_(Message.date, Message.id) > (
+                self.date,
+                uuid.UUID(self.id),
+            ),
+        )
+
+
+# Per-worker author display names, invalidated when users are updated
+author_names: dict[uuid.UUID | None, str] = {}
+
+
+def load_authors(message: type[Message] = Message) -> LoaderOption:
+    return joinedload(message.author).load_only(
+        User.first_name,
+        User.last_name,
+    )
 
 
 def serialize_author(message: Message) -> str:
+    if message.author_id in author_names:
+        return author_names[message.author_id]
+
     author = message.author
 
     if not author:
         return 'Admin'
 
-    return f'{author.first_name} {author.last_name}'
+    if len(author_names) >= AUTHOR_NAMES_CACHE_SIZE:
+        author_names.clear()
+
+    name = author_names[author.id] = f'{author.first_name} {author.last_name}'
+    return name
 
 
 class MessageSchema(Schema):
     id = fields.String()
     date = fields.DateTime()
     author = fields.Function(serialize=serialize_author)
+    channel = fields.String()
     text = fields.String()
 
 
-def notify_subscribers() -> None:
-    for subscriber_queue in tuple(subscriber_queues):
-        try:
-            subscriber_queue.put_nowait(None)
-        except gevent.queue.Full:
-            continue
+def render_frame(kind: str, data: str, message_id: str | None) -> bytes:
+    # Changes don't move the stream position, so they have no event ID
+    event_id = f'id: {message_id}\n' if message_id else ''
+    return f'{event_id}event: {kind}\ndata: {data}\n\n'.encode()
+
+
+def render_message(message: Message, kind: str = CREATED) -> MessageEvent:
+    message_id = str(message.id)
+    return MessageEvent(
+        message_id,
+        message.date,
+        render_frame(
+            kind,
+            json.dumps(get_dump_plan(MessageSchema).dump(message)),
+            message_id if kind == CREATED else None,
+        ),
+        kind,
+        message.channel,
+    )
+
+
+def render_deletion(message_id: str, channel: str) -> MessageEvent:
+    return MessageEvent(
+        message_id,
+        datetime.datetime.min,
+        render_frame(DELETED, json.dumps({'id': message_id}), None),
+        DELETED,
+        channel,
+    )
+
+
+def render_batch(events: list[MessageEvent]) -> bytes:
+    data = b','.join(message_event.data for message_event in events)
+    return b'id: %s\nevent: %s\ndata: [%s]\n\n' % (
+        events[-1].id.encode(),
+        CREATED.encode(),
+        data,
+    )
+
+
+class BroadcastHub:
+    def __init__(self) -> None:
+        self.channels: dict[str, set[Subscriber]] = {}
+        self.cursor: StreamCursor | None = None
+        self.replay: collections.deque[MessageEvent] = collections.deque(
+            maxlen=REPLAY_BUFFER_SIZE,
+        )
+        self.evictions = 0
+
+    @property
+    def subscribers(self) -> list[Subscriber]:
+        return [
+            subscriber
+            for subscribers in self.channels.values()
+            for subscriber in subscribers
+        ]
+
+    def subscribe(
+        self,
+        high_water_mark: int,
+        channel: str = DEFAULT_CHANNEL,
+    ) -> Subscriber:
+        subscriber = Subscriber(high_water_mark, channel)
+        self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self.channels.get(subscriber.channel, set())
+        subscribers.discard(subscriber)
+
+        if not subscribers:
+            self.channels.pop(subscriber.channel, None)
+
+    def broadcast(self, events: list[MessageEvent] | None) -> None:
+        if events is None:
+            # Every stream has to catch up
+            self.push(self.subscribers, None)
+            return
+
+        channel_events: dict[str, list[MessageEvent]] = {}
+
+        for message_event in events:
+            channel_events.setdefault(message_event.channel, []).append(
+                message_event,
+            )
+
+        # Only wakes up the streams of these channels
+        for channel, routed_events in channel_events.items():
+            self.push(tuple(self.channels.get(channel, ())), routed_events)
+
+    def push(
+        self,
+        subscribers: Iterable[Subscriber],
+        events: list[MessageEvent] | None,
+    ) -> None:
+        for subscriber in subscribers:
+            if not subscriber.push(events):
+                # Slow consumers are dropped rather than buffered forever
+                self.unsubscribe(subscriber)
+                self.evictions += 1
+
+    def send_heartbeats(self, keep_alive: float) -> None:
+        idle_since = time.monotonic() - keep_alive
+
+        for subscriber in self.subscribers:
+            if subscriber.active <= idle_since and subscriber.queue.empty():
+                subscriber.heartbeat = True
+                subscriber.queue.put_nowait([])
+
+    def stats(self) -> dict[str, int]:
+        lags = [subscriber.queue.qsize() for subscriber in self.subscribers]
+        return {
+            'channels': len(self.channels),
+            'subscribers': len(lags),
+            'total_lag': sum(lags),
+            'max_lag': max(lags, default=0),
+            'evictions': self.evictions,
+        }
+
+    def fetch(
+        self,
+        condition: ColumnElement[bool],
+        kind: str = CREATED,
+    ) -> list[MessageEvent]:
+        return [
+            render_message(message, kind)
+            for message in db.session.scalars(
+                select(Message)
+                .options(load_authors())
+                .where(condition)
+                .order_by(Message.date, Message.id)
+            )
+        ]
+
+    def start(self) -> None:
+        if self.cursor:
+            self.catch_up()
+            return
+
+        self.cursor = StreamCursor()
+        latest = db.session.execute(
+            select(Message.id, Message.date)
+            .order_by(Message.date.desc(), Message.id.desc())
+            .limit(1)
+        ).first()
+
+        if latest:
+            self.cursor.advance(str(latest.id), latest.date)
+
+        # Unknown position before the first start, streams catch up instead
+        self.broadcast(None)
+
+    def catch_up(self) -> None:
+        cursor = self.cursor
+
+        if not cursor:
+            self.broadcast(None)
+            return
+
+        self.publish(self.fetch(cursor.after()))
+
+    def dispatch(self, payload: str) -> None:
+        if not payload:
+            # Too many changes to fit in the payload
+            self.catch_up()
+            return
+
+        data = json.loads(payload)
+
+        if 'authors' in data:
+            self.invalidate_authors(data['authors'])
+            return
+
+        if 'ids' in data:
+            self.publish(self.fetch(Message.id.in_(data['ids'])))
+            return
+
+        if UPDATED in data:
+            self.publish(self.fetch(Message.id.in_(data[UPDATED]), UPDATED))
+            return
+
+        if DELETED in data:
+            self.publish([
+                render_deletion(message_id, data['channel'])
+                for message_id in data[DELETED]
+            ])
+            return
+
+        if 'events' in data:
+            # Fetched and rendered by the node message broker
+            self.publish([
+                MessageEvent(
+                    message_id,
+                    datetime.datetime.fromisoformat(date),
+                    frame.encode(),
+                    kind,
+                    channel,
+                )
+                for message_id, date, frame, kind, channel in data['events']
+            ])
+            return
+
+        self.publish([
+            MessageEvent(
+                message['id'],
+                datetime.datetime.fromisoformat(message['date']),
+                render_frame(CREATED, json.dumps(message), message['id']),
+                CREATED,
+                message['channel'],
+            )
+            for message in data['messages']
+        ])
+
+    def invalidate_authors(self, author_ids: list[str]) -> None:
+        for author_id in author_ids:
+            author_names.pop(uuid.UUID(author_id), None)
+
+    def publish(self, events: list[MessageEvent]) -> None:
+        if self.cursor:
+            for message_event in events:
+                if message_event.kind == CREATED:
+                    self.cursor.advance(message_event.id, message_event.date)
+
+        self.replay.extend(events)
+        self.broadcast(events)
+
+    def replay_from(
+        self,
+        message_id: str,
+        channel: str,
+    ) -> list[MessageEvent]:
+        for index, message_event in enumerate(self.replay):
+            if (
+                message_event.id,
+                message_event.kind,
+                message_event.channel,
+            ) == (message_id, CREATED, channel):
+                return [
+                    replayed_event
+                    for replayed_event in itertools.islice(
+                        self.replay,
+                        index,
+                        None,
+                    )
+                    if replayed_event.channel == channel
+                ]
+
+        return []
+
+
+hub = BroadcastHub()
+listener_greenlet: (
+    gevent.Greenlet[[Flask, BroadcastHub, str | None], None] | None
+) = None
+heartbeat_greenlet: gevent.Greenlet[[Flask], None] | None = None
 
 
 def ensure_listener_running() -> None:
-    global listener_greenlet
+    global heartbeat_greenlet, listener_greenlet
+
+    app = cast(Flask, current_app._get_current_object())  # type: ignore
+
+    if app.config['STREAM_KEEP_ALIVE'] and (
+        not heartbeat_greenlet or heartbeat_greenlet.dead
+    ):
+        heartbeat_greenlet = gevent.spawn(send_heartbeats, app)
 
     if listener_greenlet and not listener_greenlet.dead:
         return
 
-    listener_greenlet = gevent.spawn(listen_notifications)
+    listener_greenlet = gevent.spawn(
+        listen_notifications,
+        app,
+        hub,
+        app.config['MESSAGES_BROKER_SOCKET'],
+    )
 
 
-def listen_notifications() -> None:
-    global listener_greenlet
+def send_heartbeats(app: Flask) -> None:
+    # No keep-alive disables heartbeats
+    while keep_alive := app.config['STREAM_KEEP_ALIVE']:
+        # Idle streams stay silent for 1.5 times the keep-alive at most
+        gevent.sleep(keep_alive / 2)
+        hub.send_heartbeats(keep_alive)
+
 
-    connection = db.engine.raw_connection()
+def connect_notifications(
+    app: Flask,
+    broker_socket: str | None,
+) -> NotificationConnection:
+    if broker_socket:
+        # The node message broker LISTENs and fetches for all workers
+        return BrokerConnection(broker_socket)
+
+    # Short-lived app contexts release the session between uses
+    with app.app_context():
+        connection = db.engine.raw_connection()
 
     try:
+        # Held for the worker lifetime, don't take a pool slot
+        connection.detach()
         cursor = connection.cursor()
         cursor.execute(f'LISTEN {MESSAGES_CHANNEL};')
         connection.commit()
 
+    except Exception:
+        connection.close()
+        raise
+
+    return cast(NotificationConnection, connection)
+
+
+def listen_notifications(
+    app: Flask,
+    message_hub: BroadcastHub,
+    broker_socket: str | None,
+) -> None:
+    global listener_greenlet
+
+    reconnect_delay = app.config['LISTENER_RECONNECT_DELAY']
+
+    try:
         while True:
-            connection.poll()
+            connection = None
+            connected = None
 
-            while connection.notifies:
-                connection.notifies.pop(0)
-                notify_subscribers()
+            try:
+                connection = connect_notifications(app, broker_socket)
 
-            gevent.sleep(0.1)
+                with app.app_context():
+                    message_hub.start()
 
-    except Exception:
-        current_app.logger.exception('Message notification listener stopped')
+                connected = time.monotonic()
+                receive_notifications(app, connection, message_hub)
+
+            except Exception:
+                app.logger.exception('Message notification listener stopped')
+
+            finally:
+                if connection:
+                    connection.close()
+
+            # Connections failing right away keep backing off
+            if connected is not None and (
+                time.monotonic() - connected
+                >= app.config['LISTENER_RECONNECT_MAX_DELAY']
+            ):
+                reconnect_delay = app.config['LISTENER_RECONNECT_DELAY']
+
+            gevent.sleep(reconnect_delay)
+            reconnect_delay = min(
+                reconnect_delay * 2,
+                app.config['LISTENER_RECONNECT_MAX_DELAY'],
+            )
 
     finally:
         listener_greenlet = None
-        connection.close()
 
 
-def notify_messages() -> None:
+def receive_notifications(
+    app: Flask,
+    connection: NotificationConnection,
+    message_hub: BroadcastHub,
+) -> None:
+    while True:
+        wait_read(connection.fileno())
+        connection.poll()
+
+        while connection.notifies:
+            notification = connection.notifies.pop(0)
+
+            # Other services may NOTIFY on the channel too
+            try:
+                with app.app_context():
+                    message_hub.dispatch(notification.payload)
+
+            except Exception:
+                app.logger.exception(
+                    'Message notification dropped: %r',
+                    notification.payload,
+                )
+
+
+def get_notification_payload(messages: Iterable[MessageInfo]) -> str:
+    ordered = sorted(
+        messages,
+        key=lambda message: (message['date'], message['id']),
+    )
+
+    for payload in (
+        json.dumps({'messages': ordered}),
+        json.dumps({'ids': [message['id'] for message in ordered]}),
+    ):
+        if len(payload.encode()) < NOTIFY_PAYLOAD_LIMIT:
+            return payload
+
+    # Listeners catch up from the database instead
+    return ''
+
+
+def get_change_payloads(kind: str, channels: dict[str, str]) -> list[str]:
+    channel_ids: dict[str, list[str]] = {}
+
+    for message_id, channel in sorted(channels.items()):
+        channel_ids.setdefault(channel, []).append(message_id)
+
+    return [
+        json.dumps({
+            kind: message_ids[start:start + NOTIFY_IDS_CHUNK_SIZE],
+            'channel': channel,
+        })
+        for channel, message_ids in channel_ids.items()
+        for start in range(0, len(message_ids), NOTIFY_IDS_CHUNK_SIZE)
+    ]
+
+
+def notify_messages(payload: str) -> None:
     with db.engine.begin() as connection:
         connection.execute(
             text('SELECT pg_notify(:channel, :payload)'),
-            {'channel': MESSAGES_CHANNEL, 'payload': ''},
+            {'channel': MESSAGES_CHANNEL, 'payload': payload},
         )
 
 
-@event.listens_for(Session, 'after_flush')
-def mark_messages_changed(session: Session, _: object) -> None:
-    for changed_entity in (
-        session.new | session.dirty | session.deleted
+def dump_message(message: Message) -> MessageInfo:
+    return cast(MessageInfo, get_dump_plan(MessageSchema).dump(message))
+
+
+message_changes = ChangeFeed(Message, dump_message)
+notify_trigger: bool | None = None
+# Only names are cached
+author_changes = ChangeFeed(
+    User,
+    operator.attrgetter('id'),
+    ('first_name', 'last_name'),
+)
+
+
+def has_notify_trigger() -> bool:
+    global notify_trigger
+
+    if notify_trigger is None:
+        with db.engine.connect() as connection:
+            notify_trigger = bool(connection.scalar(text(
+                'SELECT EXISTS (SELECT FROM pg_trigger '
+                "WHERE tgname = 'message_notify_created')"
+            )))
+
+    return notify_trigger
+
+
+@message_changes.subscribe
+def notify_message_changes(changes: Changes[MessageInfo]) -> None:
+    # Already notified from within the transaction
+    if has_notify_trigger():
+        return
+
+    payloads = (
+        [get_notification_payload(changes.created.values())]
+        if changes.created else []
+    )
+
+    for kind, messages in (
+        (UPDATED, changes.updated),
+        (DELETED, changes.deleted),
     ):
-        if isinstance(changed_entity, Message):
-            session.info[SESSION_MESSAGES_CHANGED_KEY] = True
-            return
+        payloads += get_change_payloads(kind, {
+            message['id']: message['channel']
+            for message in messages.values()
+        })
+
+    for payload in payloads:
+        notify_messages(payload)
+
+
+@author_changes.subscribe
+def notify_author_changes(changes: Changes[uuid.UUID]) -> None:
+    changed_authors = {**changes.updated, **changes.deleted}
+
+    for author_id in changed_authors:
+        author_names.pop(author_id, None)
+
+    if changed_authors:
+        # Other workers drop their cached names too
+        notify_messages(json.dumps({
+            'authors': sorted(map(str, changed_authors)),
+        }))
+
+
+def resume_stream(
+    last_event_id: str | None,
+    cursor: StreamCursor,
+    channel: str,
+) -> list[MessageEvent] | None:
+    # None catches up from the database, after the cursor
+    if not last_event_id:
+        return None
+
+    replay = hub.replay_from(last_event_id, channel)
+
+    if replay:
+        last_event, *events = replay
+        cursor.advance(last_event.id, last_event.date)
+        return events
+
+    try:
+        message = db.session.get(
+            Message,
+            uuid.UUID(last_event_id),
+            options=[load_authors()],
+        )
+    except ValueError:
+        message = None
+
+    if message:
+        cursor.advance(str(message.id), message.date)
+
+    return None
 
 
-@event.listens_for(Session, 'after_commit')
-def trigger_message_notifications(session: Session) -> None:
-    messages_changed = session.info.pop(SESSION_MESSAGES_CHANGED_KEY, False)
+def select_catch_up(
+    cursor: StreamCursor,
+    backlog_size: int,
+    channel: str,
+) -> Select[tuple[Message]]:
+    # One more than the backlog tells whether older ones were left out
+    latest = (
+        select(Message)
+        .where(Message.channel == channel, cursor.after())
+        .order_by(Message.date.desc(), Message.id.desc())
+        .limit(backlog_size + 1)
+        .subquery()
+    )
+    latest_message = aliased(Message, latest)
+    return (
+        select(latest_message)
+        .options(load_authors(latest_message))
+        .order_by(latest_message.date, latest_message.id)
+    )
+
+
+def render_gap(message: Message) -> MessageEvent:
+    return MessageEvent(
+        str(message.id),
+        datetime.datetime.min,
+        render_frame(
+            GAP,
+            json.dumps({'before': get_history_cursor(message)}),
+            None,
+        ),
+        GAP,
+        message.channel,
+    )
+
+
+def catch_up_events(
+    cursor: StreamCursor,
+    backlog_size: int,
+    channel: str,
+) -> list[MessageEvent]:
+    messages = list(db.session.scalars(
+        select_catch_up(cursor, backlog_size, channel),
+    ))
+    events = []
+
+    if len(messages) > backlog_size:
+        del messages[0]
+
+        # Resumed streams page through the history for the rest
+        if messages and cursor.date != datetime.datetime.min:
+            events.append(render_gap(messages[0]))
+
+    return events + [render_message(message) for message in messages]
+
+
+def render_created(events: list[MessageEvent], batch: bool) -> list[bytes]:
+    if batch and events:
+        return [render_batch(events)]
+
+    return [message_event.frame for message_event in events]
+
+
+def render_events(
+    cursor: StreamCursor,
+    events: list[MessageEvent],
+    batch: bool,
+) -> list[bytes]:
+    frames: list[bytes] = []
+    created: list[MessageEvent] = []
+
+    for message_event in events:
+        if message_event.kind != CREATED:
+            # In order, after the messages created before the change
+            frames += render_created(created, batch)
+            frames.append(message_event.frame)
+            created = []
+
+        # Skip messages already sent, e.g. by a database catch up
+        elif cursor.send(message_event.id, message_event.date):
+            created.append(message_event)
+
+    return frames + render_created(created, batch)
 
-    if messages_changed:
-        notify_messages()
 
+def release_connection() -> None:
+    if db.session().in_transaction():
+        # Ends the read-only transaction, streams never have pending changes
+        db.session.commit()
 
-@event.listens_for(Session, 'after_rollback')
-def clear_message_notifications(session: Session) -> None:
-    session.info.pop(SESSION_MESSAGES_CHANGED_KEY, None)
+
+def channel_field(**kwargs: Any) -> fields.String:
+    return fields.String(validate=Regexp(CHANNEL_PATTERN), **kwargs)
+
+
+class StreamArgsSchema(Schema):
+    channel = channel_field(load_default=DEFAULT_CHANNEL)
+    # Opt-in for clients handling arrays of messages
+    batch = fields.Boolean(load_default=False)
 
 
 @api.get('/messages')
 @auth.login_required
 def messages_stream() -> ResponseReturnValue:
+    args = cast(dict[str, Any], StreamArgsSchema().load(request.args))
+    batch = cast(bool, args['batch'])
+    channel = cast(str, args['channel'])
     ensure_listener_running()
-    schema = MessageSchema()
+    last_event_id = request.headers.get('Last-Event-ID')
 
-    def stream() -> Generator[str, None, None]:
-        last_date = datetime.datetime.min.replace(tzinfo=datetime.UTC)
-        subscriber_queue: gevent.queue.Queue[None] = gevent.queue.Queue(
-            maxsize=1
-        )
-        subscriber_queues.add(subscriber_queue)
+    def stream() -> Generator[bytes, None, None]:
+        config = current_app.config
+        cursor = StreamCursor()
+        subscriber = hub.subscribe(config['STREAM_HIGH_WATER_MARK'], channel)
+        replay = resume_stream(last_event_id, cursor, channel)
+        # Without replay, start with a database catch up
+        subscriber.gap = replay is None
 
-        stream_refresh_interval = current_app.config['STREAM_REFRESH_INTERVAL']
+        backlog_size = config['STREAM_BACKLOG_SIZE']
+        retry_interval = config['STREAM_RETRY_INTERVAL']
+        coalesce_window = config['STREAM_COALESCE_WINDOW'] if batch else 0
+        events = replay or []
 
         try:
             while True:
-                for message in db.session.scalars(
-                    select(Message)
-                    .where(Message.date > last_date)
-                    .order_by(Message.date)
-                ):
-                    yield f'data: {schema.dumps(message)}\n\n'
-                    last_date = message.date
+                if subscriber.evicted:
+                    # Reconnect later, resuming from the last event received
+                    yield f'retry: {retry_interval}\n\n'.encode()
+                    return
+
+                if subscriber.gap:
+                    subscriber.gap = False
+                    events = catch_up_events(
+                        cursor,
+                        backlog_size,
+                        channel,
+                    ) + events
 
-                try:
-                    subscriber_queue.get(timeout=stream_refresh_interval)
+                # Don't hold a pooled connection while writing or waiting
+                release_connection()
+                yield from render_events(cursor, events, batch)
 
-                except gevent.queue.Empty:
-                    yield ':heartbeat\n'
+                subscriber.active = time.monotonic()
+                events = subscriber.queue.get()
+
+                if subscriber.heartbeat:
+                    subscriber.heartbeat = False
+                    yield b':heartbeat\n'
+
+                if events and coalesce_window:
+                    events = subscriber.coalesce(events, coalesce_window)
 
         finally:
-            subscriber_queues.discard(subscriber_queue)
+            hub.unsubscribe(subscriber)
 
     return Response(
         stream_with_context(stream()),
@@ -158,21 +961,213 @@ def messages_stream() -> ResponseReturnValue:
     )
 
 
+@api.get('/messages/stats')
+@auth.login_required(role=Role.ADMINISTRATOR)
+def messages_stats() -> ResponseReturnValue:
+    return {'worker': os.getpid(), **hub.stats()}
+
+
+def get_history_cursor(message: Message) -> str:
+    return f'{message.date.isoformat()}_{message.id}'
+
+
+class HistoryCursor(fields.Field):  # type: ignore[type-arg]
+    def _deserialize(
+        self,
+        value: object,
+        attr: str | None,
+        data: object,
+        **kwargs: object,
+    ) -> tuple[datetime.datetime, uuid.UUID]:
+        try:
+            date, _, message_id = str(value).partition('_')
+            return datetime.datetime.fromisoformat(date), uuid.UUID(message_id)
+
+        except ValueError as error:
+            raise ValidationError('Invalid cursor.') from error
+
+
+class HistoryArgsSchema(Schema):
+    channel = channel_field(load_default=DEFAULT_CHANNEL)
+    before = HistoryCursor()
+    limit = fields.Integer(
+        load_default=HISTORY_DEFAULT_LIMIT,
+        validate=Range(min=1, max=HISTORY_MAX_LIMIT),
+    )
+
+
+@api.get('/messages/history')
+@auth.login_required
+def messages_history() -> ResponseReturnValue:
+    args = cast(dict[str, Any], HistoryArgsSchema().load(request.args))
+    limit = cast(int, args['limit'])
+    query = (
+        select(Message)
+        .options(load_authors())
+        .where(Message.channel == args['channel'])
+        .order_by(Message.date.desc(), Message.id.desc())
+    )
+
+    if 'before' in args:
+        date, message_id = args['before']
+        query = query.where(
+            Message.date <= date,
+            tuple_(Message.date, Message.id) < (date, message_id),
+        )
+
+    messages = list(db.session.scalars(query.limit(limit + 1)))
+    more = len(messages) > limit
+    messages = messages[:limit]
+
+    return {
+        'messages': get_dump_plan(MessageSchema).dump_many(
+            messages[::-1],
+        ),
+        # Oldest message of the page, where the next page starts
+        'before': get_history_cursor(messages[-1]) if more else None,
+    }
+
+
+def get_search_cursor(rank: float, message: Message) -> str:
+    return f'{rank!r}_{get_history_cursor(message)}'
+
+
+class SearchCursor(fields.Field):  # type: ignore[type-arg]
+    def _deserialize(
+        self,
+        value: object,
+        attr: str | None,
+        data: object,
+        **kwargs: object,
+    ) -> tuple[float, datetime.datetime, uuid.UUID]:
+        rank, _, position = str(value).partition('_')
+        date, message_id = HistoryCursor()._deserialize(
+            position,
+            attr,
+            data,
+            **kwargs,
+        )
+
+        try:
+            return float(rank), date, message_id
+
+        except ValueError as error:
+            raise ValidationError('Invalid cursor.') from error
+
+
+class SearchArgsSchema(Schema):
+    q = fields.String(
+        required=True,
+        validate=Length(min=1, max=SEARCH_QUERY_MAX_LENGTH),
+    )
+    channel = channel_field(load_default=DEFAULT_CHANNEL)
+    after = SearchCursor()
+    limit = fields.Integer(
+        load_default=HISTORY_DEFAULT_LIMIT,
+        validate=Range(min=1, max=HISTORY_MAX_LIMIT),
+    )
+
+
+def escape_html(value: ColumnElement[str]) -> ColumnElement[str]:
+    for character, entity in (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;')):
+        value = func.replace(value, character, entity, type_=String)
+
+    return value
+
+
+@api.get('/messages/search')
+@auth.login_required
+def messages_search() -> ResponseReturnValue:
+    args = cast(dict[str, Any], SearchArgsSchema().load(request.args))
+    limit = cast(int, args['limit'])
+    search_query = func.websearch_to_tsquery(SEARCH_CONFIG, args['q'])
+    rank = func.ts_rank(Message.search, search_query, type_=REAL)
+    query = (
+        select(
+            Message,
+            rank,
+            # Escaped first, only the <mark> tags are HTML in snippets
+            func.ts_headline(
+                SEARCH_CONFIG,
+                escape_html(Message.text.expression),
+                search_query,
+                SEARCH_HEADLINE_OPTIONS,
+                type_=String,
+            ),
+        )
+        .options(load_authors())
+        .where(
+            Message.channel == args['channel'],
+            Message.search.bool_op('@@')(search_query),
+        )
+        .order_by(rank.desc(), Message.date.desc(), Message.id.desc())
+    )
+
+    if 'after' in args:
+        after_rank, after_date, after_id = args['after']
+        query = query.where(tuple_(rank, Message.date, Message.id) < tuple_(
+            # Ranks are single precision, compare them as such
+            sql_cast(after_rank, REAL),
+            after_date,
+            after_id,
+        ))
+
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    plan = get_dump_plan(MessageSchema)
+
+    return {
+        'messages': [
+            {
+                **plan.dump(message),
+                'rank': message_rank,
+                'snippet': snippet,
+            }
+            for message, message_rank, snippet in rows
+        ],
+        # Last result of the page, where the next page starts
+        'after': get_search_cursor(rows[-1][1], rows[-1][0]) if more else None,
+    }
+
+
 class CreateMessageSchema(Schema):
     text = fields.String(validate=Length(min=1))
+    channel = channel_field(load_default=DEFAULT_CHANNEL)
+
+
+class BatchMessageSchema(Schema):
+    text = fields.String(required=True, validate=Length(min=1))
+    channel = channel_field(load_default=DEFAULT_CHANNEL)
+
+
+class CreateMessagesSchema(Schema):
+    messages = fields.List(
+        fields.Nested(BatchMessageSchema),
+        required=True,
+        validate=Length(min=1, max=BATCH_MAX_SIZE),
+    )
+
+
+def get_author() -> User | None:
+    user = cast(User | SuperAdmin, auth.current_user())
+
+    if user.email == 'admin':
+        return None
+
+    return cast(User, user)
 
 
 @api.post('/messages')
 @auth.login_required
+@rate_limited('messages')
 def messages_add() -> ResponseReturnValue:
     data = cast(dict[str, str], CreateMessageSchema().load(request.json))
 
     message = Message()
     message.text = data['text']
-    user = cast(User | SuperAdmin, auth.current_user())
-
-    if user.email != 'admin':
-        message.author = cast(User, user)
+    message.channel = data['channel']
+    message.author = get_author()
 
     db.session.add(message)
     db.session.commit()
@@ -180,6 +1175,46 @@ def messages_add() -> ResponseReturnValue:
     return {'id': str(message.id)}, 201
 
 
+@api.post('/messages/batch')
+@auth.login_required
+def messages_add_batch() -> ResponseReturnValue:
+    data = cast(
+        dict[str, list[dict[str, str]]],
+        CreateMessagesSchema().load(request.json),
+    )
+    # Charged per message, as many single posts would be
+    check_rate_limit('messages', len(data['messages']))
+    author = get_author()
+    # Same date for all, streams order by (date, id) so sorted IDs keep the
+    # given order without dating any message in the future
+    message_ids = sorted(uuid.uuid4() for _ in data['messages'])
+    # One INSERT for all messages
+    messages = db.session.scalars(
+        insert(Message)
+        .values([
+            {
+                'id': message_id,
+                'date': func.now(),
+                'author_id': author and author.id,
+                'channel': message['channel'],
+                'text': message['text'],
+            }
+            for message_id, message in zip(message_ids, data['messages'])
+        ])
+        .returning(Message)
+    ).all()
+
+    # Bulk inserts skip the flush, streams are notified once on commit
+    changes = message_changes.pending(db.session())
+
+    for message in messages:
+        changes.create(message.id, dump_message(message))
+
+    db.session.commit()
+
+    return {'ids': [str(message.id) for message in messages]}, 201
+
+
 @api.delete('/messages/<message:message>')
 @auth.login_required(role=Role.ADMINISTRATOR)
 def messages_delete(message: Message) -> ResponseReturnValue:
@@ -187,3 +1222,46 @@ def messages_delete(message: Message) -> ResponseReturnValue:
     db.session.commit()
 
     return '', 204
+
+
+class DeleteMessagesArgsSchema(Schema):
+    author = fields.UUID()
+    channel = channel_field()
+    since = fields.DateTime()
+    until = fields.DateTime()
+
+
+@api.delete('/messages')
+@auth.login_required(role=Role.ADMINISTRATOR)
+def messages_delete_range() -> ResponseReturnValue:
+    args = cast(dict[str, Any], DeleteMessagesArgsSchema().load(request.args))
+    conditions: list[ColumnElement[bool]] = []
+
+    if not args:
+        # Never delete every message by mistake
+        abort(400, 'expected_filter')
+
+    if 'author' in args:
+        conditions.append(Message.author_id == args['author'])
+
+    if 'channel' in args:
+        conditions.append(Message.channel == args['channel'])
+
+    if 'since' in args:
+        conditions.append(Message.date >= args['since'])
+
+    if 'until' in args:
+        conditions.append(Message.date < args['until'])
+
+    messages = db.session.scalars(
+        delete(Message).where(*conditions).returning(Message)
+    ).all()
+    # Bulk deletes skip the flush too
+    changes = message_changes.pending(db.session())
+
+    for message in messages:
+        changes.delete(message.id, dump_message(message))
+
+    db.session.commit()
+
+    return {'ids': [str(message.id) for message in messages]}
@@ -3,26 +3,50 @@ import uuid
 from typing import TypedDict
 
 from flask import abort, make_response
-from sqlalchemy import ForeignKey, func
+from sqlalchemy import Computed, ForeignKey, Index, String, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from werkzeug.routing import BaseConverter
 
 from backend.model import Model, db
 from backend.model.user import User
 
+# Chats mix languages, no stemming or stop words
+SEARCH_CONFIG = 'simple'
+DEFAULT_CHANNEL = 'general'
+CHANNEL_MAX_LENGTH = 32
+
 
 class MessageInfo(TypedDict):
     id: str
     date: str
     author: str
+    channel: str
     text: str
 
 
 class Message(Model):
+    __table_args__ = (
+        # Stream cursor and history pagination order
+        Index('ix_message_date_id', 'date', 'id'),
+        Index('ix_message_channel_date_id', 'channel', 'date', 'id'),
+        Index('ix_message_search', 'search', postgresql_using='gin'),
+    )
+
     id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     date: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
     author_id: Mapped[uuid.UUID | None] = mapped_column(ForeignKey(User.id))
+    channel: Mapped[str] = mapped_column(
+        String(CHANNEL_MAX_LENGTH),
+        default=DEFAULT_CHANNEL,
+        server_default=DEFAULT_CHANNEL,
+    )
     text: Mapped[str]
+    search: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{SEARCH_CONFIG}', text)", persisted=True),
+        deferred=True,
+    )
 
     author: Mapped[User | None] = relationship(User)
 
@@ -0,0 +1,173 @@
+import datetime
+import re
+
+import click
+from flask import current_app
+from sqlalchemy import Connection, text
+
+from backend.model import db
+
+from . import api
+
+PARTITION_NAME = re.compile(r'message_y(\d{4})m(\d{2})')
+DEFAULT_PARTITION = 'message_default'
+
+
+def month_start(date: datetime.date, offset: int = 0) -> datetime.date:
+    month = date.year * 12 + date.month - 1 + offset
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def get_partition_name(month: datetime.date) -> str:
+    return f'message_y{month:%Y}m{month:%m}'
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.scalar(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'message'::regclass"
+    )) is True
+
+
+def get_partitions(connection: Connection) -> list[datetime.date]:
+    names = connection.scalars(text(
+        'SELECT inhrelid::regclass::text FROM pg_inherits '
+        "WHERE inhparent = 'message'::regclass"
+    ))
+    return sorted(
+        datetime.date(int(match[1]), int(match[2]), 1)
+        for name in names
+        if (match := PARTITION_NAME.fullmatch(name))
+    )
+
+
+def create_partition(connection: Connection, month: datetime.date) -> int:
+    name = get_partition_name(month)
+    bounds = {'start': month, 'end': month_start(month, 1)}
+    partition_of = (
+        'PARTITION OF message '
+        f"FOR VALUES FROM ('{month}') TO ('{month_start(month, 1)}')"
+    )
+    stranded = connection.scalar(text(
+        f'SELECT EXISTS (SELECT FROM {DEFAULT_PARTITION} '
+        'WHERE date >= :start AND date < :end)'
+    ), bounds)
+
+    if not stranded:
+        connection.execute(text(f'CREATE TABLE {name} {partition_of}'))
+        return 0
+
+    # Messages sent while maintenance lapsed, the new partition can't be
+    # created while the default one holds some of its range
+    connection.execute(
+        text(f'ALTER TABLE message DETACH PARTITION {DEFAULT_PARTITION}'),
+    )
+    connection.execute(text(f'CREATE TABLE {name} {partition_of}'))
+    # Generated columns are computed again
+    columns = connection.scalar(text(
+        "SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) "
+        'FROM pg_attribute '
+        "WHERE attrelid = 'message'::regclass AND attnum > 0 "
+        "AND NOT attisdropped AND attgenerated = ''"
+    ))
+    # Straight into the partition, the messages aren't new
+    moved = connection.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+        f'WHERE date >= :start AND date < :end RETURNING {columns}) '
+        f'INSERT INTO {name} ({columns}) SELECT {columns} FROM moved'
+    ), bounds).rowcount
+    connection.execute(text(
+        f'ALTER TABLE message ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT'
+    ))
+    return moved
+
+
+def create_partitions(
+    connection: Connection,
+    today: datetime.date,
+    months_ahead: int,
+) -> dict[str, int]:
+    partitions = set(get_partitions(connection))
+    created = {}
+
+    for offset in range(months_ahead + 1):
+        month = month_start(today, offset)
+
+        if month not in partitions:
+            created[get_partition_name(month)] = create_partition(
+                connection,
+                month,
+            )
+
+    return created
+
+
+def prune_partitions(
+    connection: Connection,
+    today: datetime.date,
+    retention_months: int,
+    detach: bool,
+) -> list[str]:
+    expired_before = month_start(today, -retention_months)
+    pruned = []
+
+    for month in get_partitions(connection):
+        if month_start(month, 1) > expired_before:
+            break
+
+        name = get_partition_name(month)
+        connection.execute(
+            text(f'ALTER TABLE message DETACH PARTITION {name}'),
+        )
+
+        if not detach:
+            connection.execute(text(f'DROP TABLE {name}'))
+
+        pruned.append(name)
+
+    return pruned
+
+
+@api.cli.command(
+    'partitions',
+    help='Create upcoming message partitions and prune expired ones.',
+)
+@click.option(
+    '--retention',
+    type=click.IntRange(min=0),
+    help='Months of messages to keep, 0 keeps everything. '
+    'Defaults to MESSAGE_RETENTION_MONTHS.',
+)
+@click.option(
+    '--detach',
+    is_flag=True,
+    help='Keep expired partitions as standalone tables instead of dropping.',
+)
+def maintain_partitions(retention: int | None, detach: bool) -> None:
+    config = current_app.config
+    connection = db.session.connection()
+
+    if not is_partitioned(connection):
+        raise click.ClickException(
+            'The message table is not partitioned, see MESSAGE_PARTITIONING.'
+        )
+
+    if retention is None:
+        retention = config['MESSAGE_RETENTION_MONTHS']
+
+    today = datetime.date.today()
+
+    for name, moved in create_partitions(
+        connection,
+        today,
+        config['MESSAGE_PARTITIONS_AHEAD'],
+    ).items():
+        click.echo(f'Created {name}' + (
+            f', moved {moved} messages from {DEFAULT_PARTITION}'
+            if moved else ''
+        ))
+
+    if retention:
+        for name in prune_partitions(connection, today, retention, detach):
+            click.echo(f'{"Detached" if detach else "Dropped"} {name}')
+
+    db.session.commit()
@@ -0,0 +1,84 @@
+import dataclasses
+from typing import Any, cast
+
+import flask
+import orjson
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.sansio.response import Response
+
+# Dates and dataclasses are left to DefaultJSONProvider.default
+DUMPS_OPTIONS = (
+    orjson.OPT_SORT_KEYS
+    | orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_DATACLASS
+    | orjson.OPT_APPEND_NEWLINE
+)
+
+
+def has_floats(obj: Any) -> bool:
+    # Dataclasses are only expanded by DefaultJSONProvider.default
+    values = [obj]
+
+    while values:
+        value = values.pop()
+
+        if isinstance(value, float) or dataclasses.is_dataclass(value):
+            return True
+
+        if isinstance(value, dict):
+            values.extend(value.values())
+
+        elif isinstance(value, (list, tuple)):
+            values.extend(value)
+
+    return False
+
+
+class JSONProvider(DefaultJSONProvider):
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        # Not JSON, orjson would render them as null instead
+        kwargs.setdefault('allow_nan', False)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if not kwargs:
+            try:
+                return orjson.loads(s)
+
+            # Also rejects NaN and such, which json.loads() accepts
+            except orjson.JSONDecodeError:
+                pass
+
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if (
+            self.compact is False
+            or (self.compact is None and self._app.debug)
+            or not self.ensure_ascii
+            or not self.sort_keys
+        ):
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+
+        # orjson spells some of them differently, e.g. 1e-05 as 0.00001
+        if has_floats(obj):
+            return super().response(*args, **kwargs)
+
+        try:
+            data = orjson.dumps(
+                obj,
+                default=self.default,
+                option=DUMPS_OPTIONS,
+            )
+
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+
+        # DEL is escaped by json.dumps(ensure_ascii=True) too
+        if not data.isascii() or b'\x7f' in data:
+            return super().response(*args, **kwargs)
+
+        response_class = cast(type[flask.Response], self._app.response_class)
+        return response_class(data, mimetype=self.mimetype)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import dataclasses
+from collections.abc import Callable, Iterable
+from typing import Any, Generic, TypeVar
+
+from sqlalchemy import Connection, event
+from sqlalchemy.orm import Mapper, Session, object_session
+from sqlalchemy.orm.attributes import get_history
+
+M = TypeVar('M')
+S = TypeVar('S')
+SESSION_CHANGES_KEY = 'changes'
+
+
+def get_key(mapper: Mapper[Any], target: object) -> Any:
+    # Tuples for composite primary keys only
+    key = mapper.primary_key_from_instance(target)
+    return key[0] if len(key) == 1 else tuple(key)
+
+
+# Net changes of a transaction, rows created then deleted don't appear at all
+@dataclasses.dataclass
+class Changes(Generic[S]):
+    created: dict[Any, S] = dataclasses.field(default_factory=dict)
+    updated: dict[Any, S] = dataclasses.field(default_factory=dict)
+    deleted: dict[Any, S] = dataclasses.field(default_factory=dict)
+
+    def create(self, key: Any, snapshot: S) -> None:
+        self.created[key] = snapshot
+
+    def update(self, key: Any, snapshot: S) -> None:
+        if key in self.created:
+            self.created[key] = snapshot
+
+        else:
+            self.updated[key] = snapshot
+
+    def delete(self, key: Any, snapshot: S) -> None:
+        self.updated.pop(key, None)
+
+        if key in self.created:
+            del self.created[key]
+
+        else:
+            self.deleted[key] = snapshot
+
+
+class ChangeFeed(Generic[M, S]):
+    def __init__(
+        self,
+        model: type[M],
+        snapshot: Callable[[M], S],
+        attributes: Iterable[str] | None = None,
+    ) -> None:
+        self.model = model
+        self.snapshot = snapshot
+        self.attributes = tuple(attributes) if attributes else None
+        self.subscribers: list[Callable[[Changes[S]], None]] = []
+
+        # Snapshots are taken at flush time, commits expire instances
+        for name, listener in (
+            ('after_insert', self.mark_created),
+            ('after_update', self.mark_updated),
+            ('after_delete', self.mark_deleted),
+        ):
+            event.listen(model, name, listener, propagate=True)
+
+    def subscribe(
+        self,
+        subscriber: Callable[[Changes[S]], None],
+    ) -> Callable[[Changes[S]], None]:
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def pending(self, session: Session) -> Changes[S]:
+        feeds: dict[ChangeFeed[Any, Any], Changes[Any]] = (
+            session.info.setdefault(SESSION_CHANGES_KEY, {})
+        )
+
+        if self not in feeds:
+            feeds[self] = Changes()
+
+        return feeds[self]
+
+    def publish(self, changes: Changes[S]) -> None:
+        for subscriber in self.subscribers:
+            subscriber(changes)
+
+    def is_updated(self, session: Session, target: M) -> bool:
+        # Flushes also go through instances without net changes
+        if self.attributes is None:
+            return session.is_modified(target)
+
+        return any(
+            get_history(target, name).has_changes()
+            for name in self.attributes
+        )
+
+    def mark_created(
+        self,
+        mapper: Mapper[M],
+        connection: Connection,
+        target: M,
+    ) -> None:
+        if session := object_session(target):
+            self.pending(session).create(
+                get_key(mapper, target),
+                self.snapshot(target),
+            )
+
+    def mark_updated(
+        self,
+        mapper: Mapper[M],
+        connection: Connection,
+        target: M,
+    ) -> None:
+        session = object_session(target)
+
+        if session and self.is_updated(session, target):
+            self.pending(session).update(
+                get_key(mapper, target),
+                self.snapshot(target),
+            )
+
+    def mark_deleted(
+        self,
+        mapper: Mapper[M],
+        connection: Connection,
+        target: M,
+    ) -> None:
+        if session := object_session(target):
+            self.pending(session).delete(
+                get_key(mapper, target),
+                self.snapshot(target),
+            )
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_changes(session: Session) -> None:
+    feeds: dict[ChangeFeed[Any, Any], Changes[Any]] = session.info.pop(
+        SESSION_CHANGES_KEY,
+        {},
+    )
+
+    for feed, changes in feeds.items():
+        feed.publish(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def clear_changes(session: Session) -> None:
+    session.info.pop(SESSION_CHANGES_KEY, None)
@@ -1,26 +1,24 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
+import itertools
+import operator
+import os
 import pathlib
 import uuid
+from collections.abc import Iterable
 from typing import Self
 
 import magic
-from flask import abort, make_response
-from sqlalchemy import Connection, ForeignKey, event, func
-from sqlalchemy.orm import (
-    Mapped,
-    Mapper,
-    Session,
-    mapped_column,
-    object_session,
-    relationship,
-)
-from werkzeug.datastructures import FileStorage
+from flask import abort, current_app, make_response
+from sqlalchemy import BigInteger, ForeignKey, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from werkzeug.routing import BaseConverter
 from werkzeug.utils import secure_filename
 
 from . import db
+from .changes import ChangeFeed, Changes
 
 EXTENSIONS = {
     'image/png': 'png',
@@ -33,14 +31,17 @@ EXTENSIONS = {
         'officedocument.spreadsheetml.sheet'
     ): 'xlsx',
 }
+SNIFF_SIZE = 2048
 
 
-def get_extension(file: FileStorage) -> str | None:
-    data = file.read(2048)
-    file.seek(0)
+def get_extension(data: bytes) -> str | None:
     return EXTENSIONS.get(magic.from_buffer(data, mime=True))
 
 
+def get_upload_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(f'.{path.name}.upload')
+
+
 class File(db.Model):  # type: ignore
     id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     creation_date: Mapped[datetime.datetime] = mapped_column(
@@ -49,6 +50,9 @@ class File(db.Model):  # type: ignore
     author_id: Mapped[uuid.UUID | None] = mapped_column(ForeignKey('user.id'))
     filename: Mapped[str] = mapped_column(unique=True, index=True)
     original_filename: Mapped[str]
+    # Unknown for files uploaded before these were recorded
+    size: Mapped[int | None] = mapped_column(BigInteger)
+    sha256: Mapped[str | None]
 
     author: Mapped[User | None] = relationship(back_populates='files')
 
@@ -57,53 +61,72 @@ class File(db.Model):  # type: ignore
         return pathlib.Path('files', self.filename)
 
     @classmethod
-    def from_upload(cls, upload: FileStorage) -> Self:
-        extension = get_extension(upload)
+    def from_upload(cls, filename: str, chunks: Iterable[bytes]) -> Self:
+        chunks = iter(chunks)
+        head = b''
+
+        # Rejected before anything gets written
+        for chunk in chunks:
+            head += chunk
+
+            if len(head) >= SNIFF_SIZE:
+                break
+
+        extension = get_extension(head)
 
         if not extension:
             abort(400, 'invalid_file')
 
         self = cls()
-        self.filename = f'pending_id.{extension}'
-        self.original_filename = secure_filename(upload.filename or '')
-        db.session.add(self)
-        db.session.flush()
+        self.id = uuid.uuid4()
         self.filename = f'{self.id}.{extension}'
+        self.original_filename = secure_filename(filename)
+        self.size = 0
+        upload_path = get_upload_path(self.path)
+        digest = hashlib.sha256()
+
+        try:
+            with upload_path.open('xb') as upload:
+                for chunk in itertools.chain([head], chunks):
+                    upload.write(chunk)
+                    digest.update(chunk)
+                    self.size += len(chunk)
+
+                # Complete on disk before being renamed into place
+                upload.flush()
+                os.fsync(upload.fileno())
+
+            self.sha256 = digest.hexdigest()
+            db.session.add(self)
+            db.session.flush()
+
+        except BaseException:
+            upload_path.unlink(missing_ok=True)
+            raise
 
-        upload.save(self.path)
         return self
 
 
-@event.listens_for(File, 'after_delete')
-def mark_deleted_files(
-    mapper: Mapper[File],
-    connection: Connection,
-    target: File,
-) -> None:
-    session = object_session(target)
+file_changes = ChangeFeed(File, operator.attrgetter('path'))
 
-    if session is None:
-        return
 
-    session.info.setdefault(
-        'deleted_file_paths',
-        [],
-    ).append(target.path)
+@file_changes.subscribe
+def move_created_files(changes: Changes[pathlib.Path]) -> None:
+    for file_path in changes.created.values():
+        try:
+            get_upload_path(file_path).replace(file_path)
 
+        # Committed anyway, downloads of the file will fail
+        except FileNotFoundError:
+            current_app.logger.error('Upload of %s went missing', file_path)
 
-@event.listens_for(Session, 'after_commit')
-def unlink_deleted_files(session: Session) -> None:
-    file_path: pathlib.Path
 
-    for file_path in session.info.pop('deleted_file_paths', []):
+@file_changes.subscribe
+def unlink_deleted_files(changes: Changes[pathlib.Path]) -> None:
+    for file_path in changes.deleted.values():
         file_path.unlink(missing_ok=True)
 
 
-@event.listens_for(Session, 'after_rollback')
-def clear_deleted_files(session: Session) -> None:
-    session.info.pop('deleted_file_paths', None)
-
-
 class FileConverter(BaseConverter):
     def to_python(self, value: str) -> File:
         file = db.session.query(File).filter_by(filename=value).one_or_none()
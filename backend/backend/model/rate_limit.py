@@ -0,0 +1,10 @@
+from sqlalchemy.orm import Mapped, mapped_column
+
+from . import db
+
+
+class RateLimitBucket(db.Model):  # type: ignore
+    key: Mapped[str] = mapped_column(primary_key=True)
+    tokens: Mapped[float]
+    # Seconds since the epoch, as returned by the database clock
+    update_time: Mapped[float]
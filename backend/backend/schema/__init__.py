@@ -1,7 +1,14 @@
+import functools
+import operator
+from collections.abc import Callable, Iterable
+from typing import Any, TypeVar
+
 from flask_marshmallow import Marshmallow
 from marshmallow import Schema, fields
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
 
 ma = Marshmallow()
+S = TypeVar('S', bound=Schema)
 
 
 class EmptySchema(Schema):
@@ -10,3 +17,46 @@ class EmptySchema(Schema):
 
 class CreateSchema(Schema):
     id = fields.String()
+
+
+# Same output as Schema.dump(), for objects having all the dumped attributes
+class DumpPlan:
+    def __init__(self, schema: Schema) -> None:
+        if schema._hooks[PRE_DUMP] or schema._hooks[POST_DUMP]:
+            raise ValueError(f'{type(schema).__name__} has dump hooks.')
+
+        self.fields: list[tuple[
+            str,
+            str,
+            Callable[[object], Any] | None,
+            Callable[..., Any],
+        ]] = [
+            (
+                name if field.data_key is None else field.data_key,
+                name,
+                # Such fields (e.g. Function) get the whole object instead
+                operator.attrgetter(field.attribute or name)
+                if field._CHECK_ATTRIBUTE else None,
+                field._serialize,
+            )
+            for name, field in schema.dump_fields.items()
+        ]
+
+    def dump(self, obj: object) -> dict[str, Any]:
+        return {
+            key: serialize(get_value(obj) if get_value else None, name, obj)
+            for key, name, get_value, serialize in self.fields
+        }
+
+    def dump_many(self, objs: Iterable[object]) -> list[dict[str, Any]]:
+        return [self.dump(obj) for obj in objs]
+
+
+@functools.cache
+def get_schema(schema_class: type[S]) -> S:
+    return schema_class()
+
+
+@functools.cache
+def get_dump_plan(schema_class: type[Schema]) -> DumpPlan:
+    return DumpPlan(get_schema(schema_class))
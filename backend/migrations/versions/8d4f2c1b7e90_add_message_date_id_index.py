@@ -0,0 +1,28 @@
+"""Add message (date, id) index
+
+Revision ID: 8d4f2c1b7e90
+Revises: 01d29545f949
+Create Date: 2026-10-18 14:02:11.417326
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8d4f2c1b7e90'
+down_revision = '01d29545f949'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f('ix_message_date_id'),
+            ['date', 'id'],
+            unique=False,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_message_date_id'))
@@ -0,0 +1,36 @@
+"""Add message channel
+
+Revision ID: a9d3c71e5b24
+Revises: e4b2f0c6a813
+Create Date: 2026-10-18 19:12:44.081935
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a9d3c71e5b24'
+down_revision = 'e4b2f0c6a813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'channel',
+            sa.String(length=32),
+            server_default='general',
+            nullable=False,
+        ))
+        batch_op.create_index(
+            batch_op.f('ix_message_channel_date_id'),
+            ['channel', 'date', 'id'],
+            unique=False,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_message_channel_date_id'))
+        batch_op.drop_column('channel')
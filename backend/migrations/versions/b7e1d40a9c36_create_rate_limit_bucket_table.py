@@ -0,0 +1,29 @@
+"""Create rate limit bucket table
+
+Revision ID: b7e1d40a9c36
+Revises: a9d3c71e5b24
+Create Date: 2026-10-18 20:31:07.542613
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1d40a9c36'
+down_revision = 'a9d3c71e5b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'rate_limit_bucket',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('update_time', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('key', name=op.f('pk_rate_limit_bucket')),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rate_limit_bucket')
@@ -0,0 +1,103 @@
+"""Partition message table by month, if MESSAGE_PARTITIONING is enabled
+
+Revision ID: c5a7e3d91f02
+Revises: 8d4f2c1b7e90
+Create Date: 2026-10-18 16:21:37.512904
+
+"""
+import datetime
+
+import sqlalchemy as sa
+from alembic import op
+from flask import current_app
+
+# revision identifiers, used by Alembic.
+revision = 'c5a7e3d91f02'
+down_revision = '8d4f2c1b7e90'
+branch_labels = None
+depends_on = None
+
+
+# Copies of backend.demo.partitions as of this revision, migrations must not
+# change along with the app
+def month_start(date: datetime.date, offset: int = 0) -> datetime.date:
+    month = date.year * 12 + date.month - 1 + offset
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def is_partitioned() -> bool:
+    return op.get_bind().scalar(sa.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'message'::regclass"
+    )) is True
+
+
+def create_message_table(name: str, partition_by: str | None = None) -> None:
+    op.create_table(
+        name,
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column(
+            'date',
+            sa.DateTime(),
+            server_default=sa.text('now()'),
+            nullable=False,
+        ),
+        sa.Column('author_id', sa.Uuid(), nullable=True),
+        sa.Column('text', sa.String(), nullable=False),
+        postgresql_partition_by=partition_by,
+    )
+
+
+# Messages move to the new table, which then takes over the names
+def replace_message_table(name: str, primary_key: list[str]) -> None:
+    op.execute(
+        f'INSERT INTO {name} SELECT id, date, author_id, text FROM message'
+    )
+    op.drop_table('message')
+    op.rename_table(name, 'message')
+    op.create_primary_key(op.f('pk_message'), 'message', primary_key)
+    op.create_foreign_key(
+        op.f('fk_message_author_id_user'),
+        'message',
+        'user',
+        ['author_id'],
+        ['id'],
+    )
+    op.create_index(op.f('ix_message_date_id'), 'message', ['date', 'id'])
+
+
+def upgrade() -> None:
+    if not current_app.config['MESSAGE_PARTITIONING'] or is_partitioned():
+        return
+
+    create_message_table('message_partitioned', 'RANGE (date)')
+    first_date = op.get_bind().scalar(sa.text('SELECT min(date) FROM message'))
+    today = datetime.date.today()
+    month = month_start(first_date or today)
+    last_month = month_start(
+        today,
+        current_app.config['MESSAGE_PARTITIONS_AHEAD'],
+    )
+
+    while month <= last_month:
+        op.execute(
+            f'CREATE TABLE message_y{month:%Y}m{month:%m} '
+            'PARTITION OF message_partitioned '
+            f"FOR VALUES FROM ('{month}') TO ('{month_start(month, 1)}')"
+        )
+        month = month_start(month, 1)
+
+    # Anything outside of the monthly partitions, e.g. far future dates
+    op.execute(
+        'CREATE TABLE message_default PARTITION OF message_partitioned DEFAULT'
+    )
+    # Unique constraints of partitioned tables include the partition key
+    replace_message_table('message_partitioned', ['id', 'date'])
+
+
+def downgrade() -> None:
+    if not is_partitioned():
+        return
+
+    create_message_table('message_unpartitioned')
+    # Partitions are dropped with the table
+    replace_message_table('message_unpartitioned', ['id'])
@@ -0,0 +1,106 @@
+"""Add message NOTIFY triggers, if MESSAGE_NOTIFY_TRIGGER is enabled
+
+Revision ID: d2f6b8e1c047
+Revises: b7e1d40a9c36
+Create Date: 2026-10-18 21:47:19.306254
+
+"""
+from alembic import op
+from flask import current_app
+
+# revision identifiers, used by Alembic.
+revision = 'd2f6b8e1c047'
+down_revision = 'b7e1d40a9c36'
+branch_labels = None
+depends_on = None
+
+# Same payloads as backend.demo.messages.notify_message_changes
+CREATE_FUNCTION = '''
+CREATE FUNCTION notify_message_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    kind text := TG_ARGV[0];
+    payload text;
+BEGIN
+    IF NOT EXISTS (SELECT FROM changed_messages) THEN
+        RETURN NULL;
+    END IF;
+
+    IF kind = 'created' THEN
+        SELECT json_build_object('messages', json_agg(json_build_object(
+            'id', message.id,
+            'date', to_char(message.date, 'YYYY-MM-DD"T"HH24:MI:SS')
+                || CASE WHEN extract(microseconds FROM message.date)
+                    % 1000000 = 0 THEN '' ELSE to_char(message.date, '.US')
+                END,
+            'author', coalesce(
+                author.first_name || ' ' || author.last_name,
+                'Admin'
+            ),
+            'channel', message.channel,
+            'text', message.text
+        ) ORDER BY message.date, message.id))::text
+        INTO payload
+        FROM changed_messages AS message
+        LEFT JOIN "user" AS author ON author.id = message.author_id;
+
+        IF octet_length(payload) < 8000 THEN
+            PERFORM pg_notify('messages', payload);
+            RETURN NULL;
+        END IF;
+
+        -- Too big, listeners fetch the messages instead
+        kind := 'ids';
+    END IF;
+
+    FOR payload IN
+        SELECT json_build_object(
+            kind, json_agg(id ORDER BY id),
+            'channel', channel
+        )::text
+        FROM (
+            SELECT
+                id,
+                channel,
+                (row_number() OVER (PARTITION BY channel ORDER BY id) - 1)
+                    / 150 AS chunk
+            FROM changed_messages
+        ) AS numbered
+        GROUP BY channel, chunk
+        ORDER BY channel, chunk
+    LOOP
+        PERFORM pg_notify('messages', payload);
+    END LOOP;
+
+    RETURN NULL;
+END
+$$
+'''
+TRIGGERS = {
+    'message_notify_created': ('INSERT', 'NEW', 'created'),
+    'message_notify_updated': ('UPDATE', 'NEW', 'updated'),
+    'message_notify_deleted': ('DELETE', 'OLD', 'deleted'),
+}
+
+
+def upgrade() -> None:
+    if not current_app.config['MESSAGE_NOTIFY_TRIGGER']:
+        return
+
+    op.execute(CREATE_FUNCTION)
+
+    # One notification per statement rather than per row
+    for name, (operation, table, kind) in TRIGGERS.items():
+        op.execute(
+            f'CREATE TRIGGER {name} AFTER {operation} ON message '
+            f'REFERENCING {table} TABLE AS changed_messages '
+            'FOR EACH STATEMENT '
+            f"EXECUTE FUNCTION notify_message_changes('{kind}')"
+        )
+
+
+def downgrade() -> None:
+    for name in TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {name} ON message')
+
+    op.execute('DROP FUNCTION IF EXISTS notify_message_changes()')
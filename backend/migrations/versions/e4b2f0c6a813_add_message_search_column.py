@@ -0,0 +1,41 @@
+"""Add message full-text search column
+
+Revision ID: e4b2f0c6a813
+Revises: c5a7e3d91f02
+Create Date: 2026-10-18 17:48:05.230611
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'e4b2f0c6a813'
+down_revision = 'c5a7e3d91f02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'search',
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('simple', text)", persisted=True),
+            nullable=True,
+        ))
+        batch_op.create_index(
+            batch_op.f('ix_message_search'),
+            ['search'],
+            unique=False,
+            postgresql_using='gin',
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index(
+            batch_op.f('ix_message_search'),
+            postgresql_using='gin',
+        )
+        batch_op.drop_column('search')
@@ -0,0 +1,27 @@
+"""Add file size and sha256
+
+Revision ID: f3a8c2d6e519
+Revises: d2f6b8e1c047
+Create Date: 2026-10-18 23:12:40.118532
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c2d6e519'
+down_revision = 'd2f6b8e1c047'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('sha256', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_column('sha256')
+        batch_op.drop_column('size')
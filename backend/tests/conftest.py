@@ -1,6 +1,11 @@
 import collections.abc
+import datetime
+import importlib.util
 import os
-from typing import TypedDict
+import pathlib
+import uuid
+from types import ModuleType, SimpleNamespace
+from typing import Protocol, TypedDict
 
 import dotenv
 import flask_migrate
@@ -12,10 +17,15 @@ from flask_sqlalchemy.session import Session
 from sqlalchemy.orm import scoped_session
 
 from backend import create_app
+from backend.demo import messages as messages_module
+from backend.demo.model.message import Message
+from backend.model import changes as changes_module
 from backend.model import db as db_
 from backend.model.user import Role, User
 from tests.auth import admin_session, role, user_session  # noqa: F401
 
+MIGRATIONS = pathlib.Path(__file__).parents[1] / 'migrations/versions'
+
 
 class CreateUserPayload(TypedDict):
     email: str
@@ -25,6 +35,15 @@ class CreateUserPayload(TypedDict):
     enabled: bool
 
 
+class AddMessage(Protocol):
+    def __call__(
+        self,
+        text: str,
+        date: datetime.datetime,
+        message_id: uuid.UUID | None = None,
+    ) -> Message: ...
+
+
 @pytest.fixture(scope='session', autouse=True)
 def load_dotenv() -> None:
     dotenv.load_dotenv()
@@ -34,7 +53,9 @@ def load_dotenv() -> None:
 def app() -> collections.abc.Generator[Flask, None, None]:
     app = create_app({
         'TESTING': 'True',
-        'STREAM_REFRESH_INTERVAL': 0,
+        # Idle streams send a heartbeat right away
+        'STREAM_KEEP_ALIVE': .001,
+        'RATE_LIMIT_STORAGE': '',
         # Needed for redirecting to Nuxt
         'APPLICATION_ROOT': os.environ.get('SCRIPT_NAME', '/api/'),
         'EMAIL_HOST': 'localhost',
@@ -131,3 +152,55 @@ def other_user(db_session: scoped_session[Session]) -> User:
     db_session.add(user)
     db_session.flush()
     return user
+
+
+@pytest.fixture
+def add_message(db_session: scoped_session[Session]) -> AddMessage:
+    def add(
+        text: str,
+        date: datetime.datetime,
+        message_id: uuid.UUID | None = None,
+    ) -> Message:
+        message = Message()
+        message.id = message_id or uuid.uuid4()
+        message.text = text
+        message.date = date
+        db_session.add(message)
+        db_session.flush()
+        return message
+
+    return add
+
+
+@pytest.fixture
+def loopback_notifications(
+    monkeypatch: pytest.MonkeyPatch,
+    db_session: scoped_session[Session],
+) -> collections.abc.Callable[[], None]:
+    # Delivered in-process, tests never really commit
+    monkeypatch.setattr(
+        messages_module,
+        'listener_greenlet',
+        SimpleNamespace(dead=False),
+    )
+    hub = messages_module.BroadcastHub()
+    hub.start()
+    monkeypatch.setattr(messages_module, 'hub', hub)
+    monkeypatch.setattr(messages_module, 'notify_messages', hub.dispatch)
+    changes_module.clear_changes(db_session())
+    return lambda: changes_module.publish_changes(db_session())
+
+
+@pytest.fixture
+def load_migration() -> collections.abc.Callable[[str], ModuleType]:
+    def load(name: str) -> ModuleType:
+        spec = importlib.util.spec_from_file_location(
+            name,
+            MIGRATIONS / f'{name}.py',
+        )
+        assert spec and spec.loader
+        migration = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(migration)
+        return migration
+
+    return load
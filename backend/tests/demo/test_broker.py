@@ -0,0 +1,149 @@
+import json
+import pathlib
+
+import gevent
+import gevent.socket
+import pytest
+from flask import Flask
+from flask_sqlalchemy.session import Session
+from gevent.server import StreamServer
+from sqlalchemy.orm import scoped_session
+
+from backend.demo import broker as broker_module
+from backend.demo import messages as messages_module
+from backend.demo.model.message import Message
+
+
+def receive(
+    connection: messages_module.BrokerConnection,
+) -> list[messages_module.Notification]:
+    while not connection.notifies:
+        connection.poll()
+
+    notifications = connection.notifies[:]
+    connection.notifies.clear()
+    return notifications
+
+
+def test_broker_relay(
+    app: Flask,
+    db_session: scoped_session[Session],
+    tmp_path: pathlib.Path,
+) -> None:
+    message = Message()
+    message.text = 'Relayed'
+    db_session.add(message)
+    db_session.flush()
+
+    relay_hub = broker_module.RelayHub()
+    path = str(tmp_path / 'broker.sock')
+    server = StreamServer(
+        broker_module.bind_broker_socket(path),
+        relay_hub.serve,
+    )
+    server.start()
+    connection = messages_module.connect_notifications(app, path)
+    assert isinstance(connection, messages_module.BrokerConnection)
+
+    try:
+        while not relay_hub.relays:
+            gevent.sleep(0)
+
+        # Fetched and rendered once by the broker
+        relay_hub.dispatch(json.dumps({'ids': [str(message.id)]}))
+        [broker_event] = relay_hub.replay
+        [notification] = receive(connection)
+
+        hub = messages_module.BroadcastHub()
+        subscriber = hub.subscribe(8)
+        hub.dispatch(notification.payload)
+        assert subscriber.queue.get_nowait() == [broker_event]
+
+        messages_module.author_names[message.author_id] = 'Cached'
+        relay_hub.dispatch(json.dumps({'authors': [str(message.id)]}))
+        relay_hub.broadcast(None)
+        assert receive(connection) == [
+            messages_module.Notification(
+                json.dumps({'authors': [str(message.id)]}),
+            ),
+            messages_module.Notification(''),
+        ]
+
+        # Relays go away with their worker
+        connection.close()
+
+        with gevent.Timeout(1):
+            while relay_hub.relays:
+                gevent.sleep(0)
+
+    finally:
+        messages_module.author_names.clear()
+        connection.close()
+        server.stop()
+
+
+def test_broker_evicts_slow_worker(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(broker_module, 'RELAY_QUEUE_SIZE', 1)
+    relay_hub = broker_module.RelayHub()
+    broker_side, worker_side = gevent.socket.socketpair()
+    greenlet = gevent.spawn(relay_hub.serve, broker_side, None)
+    gevent.sleep(0)
+
+    with worker_side:
+        relay_hub.relay('first')
+        relay_hub.relay('second')
+        assert not relay_hub.relays
+        greenlet.join()
+        assert broker_side.fileno() == -1
+
+
+def test_broker_connection_closed(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / 'broker.sock')
+
+    with broker_module.bind_broker_socket(path) as listener:
+        connection = messages_module.BrokerConnection(path)
+        listener.accept()[0].close()
+
+        with pytest.raises(ConnectionError):
+            connection.poll()
+
+        connection.close()
+
+    with pytest.raises(OSError):
+        messages_module.BrokerConnection(path)
+
+
+def test_run_broker(
+    app: Flask,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: pathlib.Path,
+) -> None:
+    runner = app.test_cli_runner()
+    monkeypatch.setitem(app.config, 'MESSAGES_BROKER_SOCKET', None)
+    result = runner.invoke(args=['demo', 'broker'])
+    assert result.exit_code == 2
+    assert 'MESSAGES_BROKER_SOCKET is not set.' in result.output
+
+    path = tmp_path / 'broker.sock'
+    # Left over by a previous run
+    path.touch()
+    monkeypatch.setitem(app.config, 'MESSAGES_BROKER_SOCKET', str(path))
+    listened: list[tuple[object, ...]] = []
+
+    def listen_notifications(*args: object) -> None:
+        assert path.is_socket()
+        listened.append(args)
+
+    monkeypatch.setattr(
+        broker_module,
+        'listen_notifications',
+        listen_notifications,
+    )
+    result = runner.invoke(args=['demo', 'broker'])
+    assert result.exit_code == 0, result.output
+    [(listen_app, relay_hub, broker_socket)] = listened
+    assert listen_app is app
+    assert isinstance(relay_hub, broker_module.RelayHub)
+    assert broker_socket is None
@@ -1,34 +1,53 @@
 from __future__ import annotations
 
+import datetime
 import json
+import os
+import time
+import uuid
+import zlib
+from collections.abc import Callable
 from types import SimpleNamespace
-from typing import Self
+from typing import Self, cast
 
 import gevent
-import gevent.queue
 import pytest
 from flask import Flask
 from flask.testing import FlaskClient
 from flask_sqlalchemy.session import Session
+from sqlalchemy import event, select
 from sqlalchemy.orm import scoped_session
 
 from backend.demo import messages as messages_module
-from backend.demo.model.message import Message
+from backend.demo.model.message import Message, MessageInfo
+from backend.model import changes as changes_module
 from backend.model import db
 from backend.model.user import User
+from tests.conftest import AddMessage
+
+
+def parse_frame(frame: bytes) -> dict[str, str]:
+    event_id, event_type, data = frame.decode().strip().split('\n')
+    message = cast(dict[str, str], json.loads(data[len('data: '):]))
+    assert event_id == f'id: {message["id"]}'
+    assert event_type == 'event: created'
+    return message
+
+
+# Updated and deleted frames have no ID
+def parse_change(frame: bytes) -> tuple[str, dict[str, str]]:
+    event_type, data = frame.decode().strip().split('\n')
+    return (
+        event_type[len('event: '):],
+        cast(dict[str, str], json.loads(data[len('data: '):])),
+    )
 
 
 def test_messages_stream(
     test_client: FlaskClient,
     admin_session: None,
-    monkeypatch: pytest.MonkeyPatch,
+    loopback_notifications: Callable[[], None],
 ) -> None:
-    monkeypatch.setattr(
-        messages_module,
-        'listener_greenlet',
-        SimpleNamespace(dead=False),
-    )
-
     response = test_client.get('/messages')
     assert response.status_code == 200
     response_iterator = response.iter_encoded()
@@ -40,11 +59,118 @@ def test_messages_stream(
     assert next(response_iterator) == b':heartbeat\n'
     response = test_client.post('/messages', json={'text': 'Some text'})
     message_id = response.get_json()['id']
-    data = json.loads(next(response_iterator).decode()[len('data: '):])
+    loopback_notifications()
+    data = parse_frame(next(response_iterator))
     assert data['id'] == message_id
     assert data['text'] == 'Some text'
 
 
+def test_messages_stream_changes(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    db_session: scoped_session[Session],
+    add_message: AddMessage,
+) -> None:
+    response = test_client.get('/messages')
+    response_iterator = response.iter_encoded()
+
+    for _ in Message.query:
+        next(response_iterator)
+
+    assert next(response_iterator) == b':heartbeat\n'
+    first, second = (
+        add_message(text, datetime.datetime(3000, 1, day))
+        for day, text in enumerate(('First', 'Second'), start=1)
+    )
+    loopback_notifications()
+    assert [
+        parse_frame(next(response_iterator))['text'] for _ in range(2)
+    ] == ['First', 'Second']
+    assert next(response_iterator) == b':heartbeat\n'
+
+    first.text = 'Edited'
+    db_session.commit()
+    loopback_notifications()
+    kind, data = parse_change(next(response_iterator))
+    assert kind == 'updated'
+    assert data['id'] == str(first.id)
+    assert data['text'] == 'Edited'
+    assert next(response_iterator) == b':heartbeat\n'
+
+    test_client.delete(f'/messages/{first.id}')
+    loopback_notifications()
+    assert parse_change(next(response_iterator)) == (
+        'deleted',
+        {'id': str(first.id)},
+    )
+    assert next(response_iterator) == b':heartbeat\n'
+
+    test_client.delete('/messages', query_string={
+        'since': second.date.isoformat(),
+    })
+    loopback_notifications()
+    assert parse_change(next(response_iterator)) == (
+        'deleted',
+        {'id': str(second.id)},
+    )
+    response.close()
+
+
+def test_messages_stream_channels(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+) -> None:
+    general = test_client.get('/messages')
+    general_iterator = general.iter_encoded()
+
+    for _ in Message.query.filter_by(channel='general'):
+        next(general_iterator)
+
+    assert next(general_iterator) == b':heartbeat\n'
+    random = test_client.get('/messages', query_string={'channel': 'random'})
+    random_iterator = random.iter_encoded()
+    assert next(random_iterator) == b':heartbeat\n'
+    assert messages_module.hub.stats()['channels'] == 2
+
+    test_client.post('/messages', json={'text': 'Hi', 'channel': 'random'})
+    test_client.post('/messages/batch', json={'messages': [
+        {'text': 'Batched', 'channel': 'random'},
+    ]})
+    loopback_notifications()
+    history = test_client.get(
+        '/messages/history',
+        query_string={'channel': 'random'},
+    ).get_json()['messages']
+    assert [parse_frame(next(random_iterator)) for _ in range(2)] == history
+    assert {message['channel'] for message in history} == {'random'}
+    # Other channels aren't woken up
+    assert next(general_iterator) == b':heartbeat\n'
+
+    random.close()
+    general.close()
+
+
+def test_messages_channel_invalid(
+    test_client: FlaskClient,
+    admin_session: None,
+) -> None:
+    for channel in ('', 'UPPER', '-dash', 'x' * 33, 'with space'):
+        response = test_client.post(
+            '/messages',
+            json={'text': 'Some text', 'channel': channel},
+        )
+        assert response.status_code == 400
+        assert list(response.get_json()) == ['channel']
+
+        response = test_client.get(
+            '/messages/history',
+            query_string={'channel': channel},
+        )
+        assert response.status_code == 400
+
+
 def test_messages_post_invalid(
     test_client: FlaskClient,
     admin_session: None,
@@ -77,6 +203,7 @@ def test_messages_post_empty(
 def test_messages_post_valid(
     test_client: FlaskClient,
     admin_session: None,
+    loopback_notifications: Callable[[], None],
 ) -> None:
     before_count = Message.query.count()
 
@@ -96,7 +223,8 @@ def test_messages_post_valid(
     assert response.json == {'id': str(last_message.id)}
 
     assert next(response_iterator) == b':heartbeat\n'
-    data = json.loads(next(response_iterator).decode()[len('data: '):])
+    loopback_notifications()
+    data = parse_frame(next(response_iterator))
     assert data['id'] == str(last_message.id)
     assert data['text'] == 'Some text'
 
@@ -143,7 +271,1047 @@ def test_messages_delete_missing(
     assert response.get_json() == {'message': 'message_not_found'}
 
 
-def test_trigger_message_notifications(
+def test_messages_post_batch(
+    test_client: FlaskClient,
+    user_session: None,
+    user: User,
+    loopback_notifications: Callable[[], None],
+) -> None:
+    subscriber = messages_module.hub.subscribe(8)
+    statements: list[str] = []
+
+    def count_statement(*args: object) -> None:
+        statements.append(str(args[2]))
+
+    texts = ['First', 'Second', 'Third']
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    try:
+        response = test_client.post('/messages/batch', json={
+            'messages': [{'text': text} for text in texts],
+        })
+
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    assert response.status_code == 201
+    assert len([
+        statement
+        for statement in statements
+        if statement.startswith('INSERT')
+    ]) == 1
+    ids = response.get_json()['ids']
+    messages = Message.query.filter(Message.id.in_(ids)).order_by(
+        Message.date,
+        Message.id,
+    ).all()
+    assert [str(message.id) for message in messages] == ids
+    assert [message.text for message in messages] == texts
+    assert {message.author_id for message in messages} == {user.id}
+    # Never dated after messages posted since, IDs keep the order
+    assert len({message.date for message in messages}) == 1
+
+    # Subscribers wake up once for the whole batch
+    loopback_notifications()
+    events = subscriber.queue.get_nowait()
+    assert [message_event.id for message_event in events] == ids
+    assert parse_frame(events[0].frame)['author'] == 'New User'
+    assert subscriber.queue.empty()
+
+
+def test_messages_post_batch_invalid(
+    test_client: FlaskClient,
+    admin_session: None,
+) -> None:
+    before_count = Message.query.count()
+
+    response = test_client.post('/messages/batch', json={'messages': []})
+    assert response.status_code == 400
+    assert response.get_json() == {
+        'messages': ['Length must be between 1 and 1000.'],
+    }
+
+    response = test_client.post('/messages/batch', json={
+        'messages': [{'text': 'Valid'}, {}],
+    })
+    assert response.status_code == 400
+    assert response.get_json() == {
+        'messages': {'1': {'text': ['Missing data for required field.']}},
+    }
+    assert Message.query.count() == before_count
+
+
+def test_messages_delete_range(
+    test_client: FlaskClient,
+    admin_session: None,
+    db_session: scoped_session[Session],
+    user: User,
+    add_message: AddMessage,
+) -> None:
+    dates = [datetime.datetime(3000, 1, day) for day in range(1, 5)]
+    messages = [
+        add_message(f'Message {index}', date)
+        for index, date in enumerate(dates)
+    ]
+    messages[0].author = messages[3].author = user
+    db_session.flush()
+    message_ids = [str(message.id) for message in messages]
+
+    response = test_client.delete('/messages', query_string={
+        'since': dates[1].isoformat(),
+        'until': dates[3].isoformat(),
+    })
+    assert response.status_code == 200
+    assert sorted(response.get_json()['ids']) == sorted(message_ids[1:3])
+
+    response = test_client.delete(
+        '/messages',
+        query_string={'author': str(user.id)},
+    )
+    assert response.status_code == 200
+    assert sorted(response.get_json()['ids']) == sorted(
+        [message_ids[0], message_ids[3]],
+    )
+    assert not Message.query.filter(Message.id.in_(message_ids)).all()
+
+
+def test_messages_delete_range_invalid(
+    test_client: FlaskClient,
+    admin_session: None,
+) -> None:
+    before_count = Message.query.count()
+
+    response = test_client.delete('/messages')
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'expected_filter'}
+
+    response = test_client.delete(
+        '/messages',
+        query_string={'author': 'nobody'},
+    )
+    assert response.status_code == 400
+    assert response.get_json() == {'author': ['Not a valid UUID.']}
+    assert Message.query.count() == before_count
+
+
+def test_messages_delete_range_user(
+    test_client: FlaskClient,
+    user_session: None,
+) -> None:
+    response = test_client.delete(
+        '/messages',
+        query_string={'since': '2000-01-01T00:00:00'},
+    )
+    assert response.status_code == 403
+
+
+def test_messages_stream_hub_catch_up(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    response = test_client.get('/messages')
+    response_iterator = response.iter_encoded()
+
+    for _ in Message.query:
+        next(response_iterator)
+
+    assert next(response_iterator) == b':heartbeat\n'
+    monkeypatch.setattr(messages_module, 'NOTIFY_PAYLOAD_LIMIT', 0)
+    test_client.post('/messages', json={'text': 'First'})
+    test_client.post('/messages', json={'text': 'Second'})
+    loopback_notifications()
+
+    texts = [
+        parse_frame(next(response_iterator))['text']
+        for _ in range(2)
+    ]
+    assert sorted(texts) == ['First', 'Second']
+    assert next(response_iterator) == b':heartbeat\n'
+
+    # Already published, the next catch up finds nothing new
+    messages_module.hub.catch_up()
+    assert next(response_iterator) == b':heartbeat\n'
+
+
+def test_messages_stream_catches_up_on_gap(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+) -> None:
+    response = test_client.get('/messages')
+    response_iterator = response.iter_encoded()
+
+    for _ in Message.query:
+        next(response_iterator)
+
+    assert next(response_iterator) == b':heartbeat\n'
+    test_client.post('/messages', json={'text': 'First'})
+    message = Message.query.filter_by(text='First').one()
+    [subscriber] = messages_module.hub.subscribers
+    messages_module.hub.broadcast([messages_module.MessageEvent(
+        str(message.id),
+        message.date,
+        b'id: id\ndata: {}\n\n',
+    )])
+
+    # Events may have been lost, e.g. while the listener was reconnecting
+    messages_module.hub.broadcast(None)
+    assert subscriber.gap is True
+    data = parse_frame(next(response_iterator))
+    assert data['text'] == 'First'
+    # Queued events were already sent by the database catch up
+    assert next(response_iterator) == b':heartbeat\n'
+
+
+def parse_batch(frame: bytes) -> list[dict[str, str]]:
+    event_id, event_type, data = frame.decode().strip().split('\n')
+    messages = cast(list[dict[str, str]], json.loads(data[len('data: '):]))
+    assert event_id == f'id: {messages[-1]["id"]}'
+    assert event_type == 'event: created'
+    return messages
+
+
+def test_messages_stream_batch(
+    app: Flask,
+    test_client: FlaskClient,
+    db_session: scoped_session[Session],
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    monkeypatch: pytest.MonkeyPatch,
+    add_message: AddMessage,
+) -> None:
+    for text in ('First', 'Second'):
+        test_client.post('/messages', json={'text': text})
+
+    monkeypatch.setitem(app.config, 'STREAM_COALESCE_WINDOW', .01)
+    response = test_client.get('/messages', query_string={'batch': 'true'})
+    response_iterator = response.iter_encoded()
+    assert {
+        message['text']
+        for message in parse_batch(next(response_iterator))
+    } >= {'First', 'Second'}
+    assert next(response_iterator) == b':heartbeat\n'
+
+    # A burst of notifications within the window
+    for day, text in enumerate(('Third', 'Fourth'), start=1):
+        add_message(text, datetime.datetime(3000, 1, day))
+        loopback_notifications()
+
+    assert [
+        message['text']
+        for message in parse_batch(next(response_iterator))
+    ] == ['Third', 'Fourth']
+    assert next(response_iterator) == b':heartbeat\n'
+    response.close()
+
+
+def test_messages_stream_batch_invalid(
+    test_client: FlaskClient,
+    admin_session: None,
+) -> None:
+    response = test_client.get('/messages', query_string={'batch': 'maybe'})
+    assert response.status_code == 400
+    assert response.get_json() == {'batch': ['Not a valid boolean.']}
+
+
+def test_messages_stream_evicts_slow_consumer(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setitem(app.config, 'STREAM_HIGH_WATER_MARK', 2)
+    monkeypatch.setitem(app.config, 'STREAM_RETRY_INTERVAL', 1000)
+    response = test_client.get('/messages')
+    response_iterator = response.iter_encoded()
+
+    for _ in Message.query:
+        next(response_iterator)
+
+    assert next(response_iterator) == b':heartbeat\n'
+    hub = messages_module.hub
+    [subscriber] = hub.subscribers
+
+    # The client stops reading while messages keep coming
+    for text in ('First', 'Second'):
+        test_client.post('/messages', json={'text': text})
+        loopback_notifications()
+
+    assert hub.stats() == {
+        'channels': 1,
+        'subscribers': 1,
+        'total_lag': 2,
+        'max_lag': 2,
+        'evictions': 0,
+    }
+    test_client.post('/messages', json={'text': 'Third'})
+    loopback_notifications()
+    assert subscriber.evicted is True
+    assert hub.stats() == {
+        'channels': 0,
+        'subscribers': 0,
+        'total_lag': 0,
+        'max_lag': 0,
+        'evictions': 1,
+    }
+
+    # Whatever was queued is dropped, resuming will send it again
+    assert next(response_iterator) == b'retry: 1000\n\n'
+    assert list(response_iterator) == []
+
+
+def test_messages_stats(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+) -> None:
+    messages_module.hub.evictions = 3
+    response = test_client.get('/messages/stats')
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'worker': os.getpid(),
+        'channels': 0,
+        'subscribers': 0,
+        'total_lag': 0,
+        'max_lag': 0,
+        'evictions': 3,
+    }
+
+
+def test_messages_stats_user(
+    test_client: FlaskClient,
+    user_session: None,
+) -> None:
+    response = test_client.get('/messages/stats')
+    assert response.status_code == 403
+
+
+def test_messages_stream_replay(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+) -> None:
+    date = datetime.datetime.now()
+    messages_module.hub.publish([
+        messages_module.MessageEvent(
+            message_id,
+            date,
+            f'id: {message_id}\ndata: {{}}\n\n'.encode(),
+        )
+        for message_id in ('first', 'second', 'third')
+    ])
+
+    # Replayed from the buffer, not from the database
+    response = test_client.get(
+        '/messages',
+        headers={'Last-Event-ID': 'first'},
+    )
+    response_iterator = response.iter_encoded()
+    assert next(response_iterator) == b'id: second\ndata: {}\n\n'
+    assert next(response_iterator) == b'id: third\ndata: {}\n\n'
+    assert next(response_iterator) == b':heartbeat\n'
+    response.close()
+
+    response = test_client.get(
+        '/messages',
+        headers={'Last-Event-ID': 'third'},
+    )
+    assert next(response.iter_encoded()) == b':heartbeat\n'
+    response.close()
+
+
+def test_messages_stream_resume_from_database(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    db_session: scoped_session[Session],
+    add_message: AddMessage,
+) -> None:
+    first_message = add_message(
+        'First',
+        datetime.datetime(2000, 1, 1),
+    )
+    add_message('Second', datetime.datetime(2000, 1, 2))
+
+    response = test_client.get(
+        '/messages',
+        headers={'Last-Event-ID': str(first_message.id)},
+    )
+    response_iterator = response.iter_encoded()
+    assert parse_frame(next(response_iterator))['text'] == 'Second'
+    assert next(response_iterator) == b':heartbeat\n'
+    response.close()
+
+    # Unknown events replay the backlog
+    for last_event_id in (
+        'not-a-uuid',
+        '00000000-0000-0000-0000-000000000000',
+    ):
+        response = test_client.get(
+            '/messages',
+            headers={'Last-Event-ID': last_event_id},
+        )
+        response_iterator = response.iter_encoded()
+
+        for _ in Message.query:
+            next(response_iterator)
+
+        assert next(response_iterator) == b':heartbeat\n'
+        response.close()
+
+
+def test_messages_stream_backlog(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    for text in ('First', 'Second', 'Third'):
+        test_client.post('/messages', json={'text': text})
+
+    latest_messages = Message.query.order_by(
+        Message.date.desc(),
+        Message.id.desc(),
+    ).limit(2).all()
+    monkeypatch.setitem(app.config, 'STREAM_BACKLOG_SIZE', 2)
+
+    response = test_client.get('/messages')
+    response_iterator = response.iter_encoded()
+    assert [
+        parse_frame(next(response_iterator))['id']
+        for _ in range(2)
+    ] == [str(message.id) for message in latest_messages[::-1]]
+    assert next(response_iterator) == b':heartbeat\n'
+    response.close()
+
+
+def test_messages_stream_resume_backlog(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    db_session: scoped_session[Session],
+    monkeypatch: pytest.MonkeyPatch,
+    add_message: AddMessage,
+) -> None:
+    messages = [
+        add_message(str(day), datetime.datetime(2000, 1, day))
+        for day in range(1, 11)
+    ]
+    monkeypatch.setitem(app.config, 'STREAM_BACKLOG_SIZE', 2)
+
+    # Older than the backlog, only the latest messages are sent
+    response = test_client.get(
+        '/messages',
+        headers={'Last-Event-ID': str(messages[0].id)},
+    )
+    response_iterator = response.iter_encoded()
+    assert next(response_iterator) == (
+        b'event: gap\ndata: {"before": "%s"}\n\n'
+        % messages_module.get_history_cursor(messages[-2]).encode()
+    )
+    assert [
+        parse_frame(next(response_iterator))['text']
+        for _ in range(2)
+    ] == ['9', '10']
+    assert next(response_iterator) == b':heartbeat\n'
+    response.close()
+
+    # Missing ones are in the history
+    response = test_client.get('/messages/history', query_string={
+        'before': messages_module.get_history_cursor(messages[-2]),
+    })
+    assert [
+        message['text'] for message in response.get_json()['messages']
+    ] == [str(day) for day in range(1, 9)]
+
+    # No gap within the backlog
+    response = test_client.get(
+        '/messages',
+        headers={'Last-Event-ID': str(messages[-3].id)},
+    )
+    response_iterator = response.iter_encoded()
+    assert [
+        parse_frame(next(response_iterator))['text']
+        for _ in range(2)
+    ] == ['9', '10']
+    assert next(response_iterator) == b':heartbeat\n'
+    response.close()
+
+
+def test_messages_stream_releases_connection(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Real pooled sessions, the test session pins a single connection
+    # pylint: disable=protected-access
+    monkeypatch.setattr(db, 'session', db._make_scoped_session({}))
+    pool = db.engine.pool
+    checked_out = pool.checkedout()  # type: ignore[attr-defined]
+    responses = []
+
+    for _ in range(1000):
+        response = test_client.get('/messages')
+        response_iterator = response.iter_encoded()
+
+        while next(response_iterator) != b':heartbeat\n':
+            pass
+
+        responses.append(response)
+
+    assert pool.checkedout() == checked_out  # type: ignore[attr-defined]
+
+    for response in reversed(responses):
+        response.close()
+
+
+def test_messages_history(
+    test_client: FlaskClient,
+    admin_session: None,
+) -> None:
+    for text in ('First', 'Second', 'Third'):
+        test_client.post('/messages', json={'text': text})
+
+    messages = Message.query.order_by(Message.date, Message.id).all()
+    ids: list[str] = []
+    before: str | None = None
+
+    while True:
+        query_string: dict[str, str | int] = {'limit': 2}
+
+        if before:
+            query_string['before'] = before
+
+        response = test_client.get(
+            '/messages/history',
+            query_string=query_string,
+        )
+        assert response.status_code == 200
+        data = response.get_json()
+        page_ids = [message['id'] for message in data['messages']]
+        assert len(page_ids) <= 2
+        ids = page_ids + ids
+        before = data['before']
+
+        if not before:
+            break
+
+    assert ids == [str(message.id) for message in messages]
+
+    response = test_client.get('/messages/history')
+    assert len(response.get_json()['messages']) == min(
+        len(messages),
+        messages_module.HISTORY_DEFAULT_LIMIT,
+    )
+
+
+def test_messages_history_invalid(
+    test_client: FlaskClient,
+    admin_session: None,
+) -> None:
+    response = test_client.get('/messages/history?before=invalid')
+    assert response.status_code == 400
+    assert response.get_json() == {'before': ['Invalid cursor.']}
+
+    response = test_client.get('/messages/history?limit=0')
+    assert response.status_code == 400
+    assert list(response.get_json()) == ['limit']
+
+
+def test_messages_search(
+    test_client: FlaskClient,
+    admin_session: None,
+    db_session: scoped_session[Session],
+    add_message: AddMessage,
+) -> None:
+    date = datetime.datetime(2000, 1, 1)
+    best, other, tied, dogs = (
+        add_message(text, date, uuid.UUID(int=index))
+        for index, text in enumerate((
+            'Cats <3 cats, cats everywhere',
+            'A cat sat on the mat',
+            'Those cats again',
+            'Dogs only',
+        ), 1)
+    )
+    # Simple config, so no stemming
+    response = test_client.get('/messages/search?q=cats')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [message['id'] for message in data['messages']] == [
+        str(best.id),
+        str(tied.id),
+    ]
+    assert data['after'] is None
+    assert data['messages'][0]['rank'] > data['messages'][1]['rank']
+    assert data['messages'][0]['snippet'] == (
+        '<mark>Cats</mark> &lt;3 <mark>cats</mark>, '
+        '<mark>cats</mark> everywhere'
+    )
+    assert data['messages'][0]['text'] == best.text
+
+    # Web search syntax
+    response = test_client.get('/messages/search?q="the mat" or dogs')
+    assert {
+        message['id'] for message in response.get_json()['messages']
+    } == {str(other.id), str(dogs.id)}
+    response = test_client.get('/messages/search?q=cat -mat')
+    assert response.get_json()['messages'] == []
+
+    # Rank ties are paged by date then ID
+    tied_again = add_message(
+        tied.text,
+        date,
+        uuid.UUID(int=5),
+    )
+    ids: list[str] = []
+    after: str | None = None
+
+    while True:
+        query_string: dict[str, str | int] = {'q': 'cats', 'limit': 1}
+
+        if after:
+            query_string['after'] = after
+
+        response = test_client.get(
+            '/messages/search',
+            query_string=query_string,
+        )
+        assert response.status_code == 200
+        data = response.get_json()
+        ids += [message['id'] for message in data['messages']]
+        after = data['after']
+
+        if not after:
+            break
+
+    assert ids == [str(best.id), str(tied_again.id), str(tied.id)]
+
+    response = test_client.get('/messages/search?q=nothing')
+    assert response.get_json() == {'messages': [], 'after': None}
+
+
+def test_messages_search_invalid(
+    test_client: FlaskClient,
+    admin_session: None,
+) -> None:
+    response = test_client.get('/messages/search')
+    assert response.status_code == 400
+    assert list(response.get_json()) == ['q']
+
+    response = test_client.get('/messages/search?q=')
+    assert response.status_code == 400
+    assert list(response.get_json()) == ['q']
+
+    for after in ('invalid', 'nan_invalid', f'1.0_{uuid.uuid4()}'):
+        response = test_client.get(
+            '/messages/search',
+            query_string={'q': 'cats', 'after': after},
+        )
+        assert response.status_code == 400
+        assert response.get_json() == {'after': ['Invalid cursor.']}
+
+
+def test_render_events() -> None:
+    cursor = messages_module.StreamCursor()
+    date = datetime.datetime(2000, 1, 1)
+    sent, first, second, third = (
+        messages_module.MessageEvent(
+            str(uuid.UUID(int=index)),
+            date,
+            messages_module.render_frame(
+                'created',
+                json.dumps({'id': str(uuid.UUID(int=index))}),
+                str(uuid.UUID(int=index)),
+            ),
+        )
+        for index in range(4)
+    )
+    cursor.send(sent.id, sent.date)
+    deleted = messages_module.render_deletion(sent.id, 'general')
+    events = [sent, first, second, deleted, third]
+
+    assert messages_module.render_events(cursor, events, batch=True) == [
+        messages_module.render_batch([first, second]),
+        deleted.frame,
+        messages_module.render_batch([third]),
+    ]
+    assert deleted.frame == (
+        f'event: deleted\ndata: {{"id": "{sent.id}"}}\n\n'.encode()
+    )
+    # Changes are always sent, created messages only once
+    assert messages_module.render_events(cursor, events, batch=False) == [
+        deleted.frame,
+    ]
+
+
+def test_stream_cursor_late_commit() -> None:
+    cursor = messages_module.StreamCursor()
+    early, late = (
+        messages_module.MessageEvent(
+            str(uuid.UUID(int=index)),
+            datetime.datetime(2000, 1, index),
+            messages_module.render_frame('created', '{}', str(index)),
+        )
+        for index in (1, 2)
+    )
+
+    assert cursor.send(late.id, late.date) is True
+    # Started before, committed after
+    assert cursor.send(early.id, early.date) is True
+    assert cursor.send(early.id, early.date) is False
+    assert (cursor.date, cursor.id) == (late.date, late.id)
+
+    for index in range(messages_module.SENT_IDS_SIZE):
+        cursor.send(str(uuid.UUID(int=index + 3)), late.date)
+
+    assert list(cursor.sent) == [
+        str(uuid.UUID(int=index + 3))
+        for index in range(messages_module.SENT_IDS_SIZE)
+    ]
+
+
+def test_stream_cursor_ties(
+    db_session: scoped_session[Session],
+    add_message: AddMessage,
+) -> None:
+    date = datetime.datetime(2000, 1, 1)
+    first, second, third = (
+        add_message(text, date, uuid.UUID(int=index))
+        for index, text in enumerate(('First', 'Second', 'Third'), 1)
+    )
+
+    cursor = messages_module.StreamCursor()
+    assert cursor.advance(str(first.id), date) is True
+    assert cursor.advance(str(first.id), date) is False
+    # Same date, the catch up still finds the following messages
+    assert db_session.scalars(
+        select(Message.text)
+        .where(cursor.after())
+        .order_by(Message.date, Message.id)
+    ).all() == ['Second', 'Third']
+
+    assert cursor.advance(str(third.id), date) is True
+    assert cursor.advance(str(second.id), date) is False
+    assert cursor.advance(str(second.id), datetime.datetime(2000, 1, 2))
+
+
+def test_messages_stream_loads_authors_in_bulk(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+    db_session: scoped_session[Session],
+    user: User,
+    other_user: User,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    for author in (user, other_user, user, other_user):
+        message = Message()
+        message.text = 'Some text'
+        message.author = author
+        db_session.add(message)
+
+    db_session.flush()
+    db_session.expunge_all()
+    monkeypatch.setattr(messages_module, 'author_names', {})
+
+    statements: list[str] = []
+
+    def count_statement(*args: object) -> None:
+        statements.append(str(args[2]))
+
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    try:
+        response = test_client.get('/messages')
+        response_iterator = response.iter_encoded()
+        authors = [
+            parse_frame(next(response_iterator))['author']
+            for _ in range(4)
+        ]
+
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    assert sorted(authors) == ['New User'] * 2 + ['Other User'] * 2
+    assert len(statements) == 1
+    response.close()
+
+
+def test_author_names_invalidation(
+    db_session: scoped_session[Session],
+    user: User,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    session = db_session()
+    changes_module.clear_changes(session)
+    monkeypatch.setattr(messages_module, 'author_names', {})
+    message = Message()
+    message.text = 'Some text'
+    message.author = user
+    db_session.add(message)
+    db_session.flush()
+    assert messages_module.author_names == {user.id: 'New User'}
+
+    # Unrelated changes keep the cache
+    user.enabled = False
+    db_session.flush()
+    assert not messages_module.author_changes.pending(session).updated
+
+    user.first_name = 'Renamed'
+    db_session.flush()
+    payloads: list[str] = []
+    monkeypatch.setattr(messages_module, 'notify_messages', payloads.append)
+    changes_module.publish_changes(session)
+    assert messages_module.author_names == {}
+    assert messages_module.serialize_author(message) == 'Renamed User'
+    assert payloads[-1] == json.dumps({'authors': [str(user.id)]})
+    assert changes_module.SESSION_CHANGES_KEY not in session.info
+
+    # Invalidated in other workers through the listener
+    messages_module.BroadcastHub().dispatch(payloads[-1])
+    assert messages_module.author_names == {}
+
+
+def test_subscriber_push() -> None:
+    subscriber = messages_module.Subscriber(2)
+    events = [messages_module.MessageEvent(
+        'id',
+        datetime.datetime.now(),
+        b'id: id\ndata: {}\n\n',
+    )]
+
+    for _ in range(2):
+        assert subscriber.push(events) is True
+
+    assert subscriber.evicted is False
+    assert subscriber.push(events) is False
+    assert subscriber.evicted is True
+    assert subscriber.gap is False
+    # Only the wake up is left
+    assert subscriber.queue.get_nowait() == []
+    assert subscriber.queue.empty()
+
+    subscriber = messages_module.Subscriber(2)
+    subscriber.push(None)
+    assert subscriber.gap is True
+    assert subscriber.queue.get_nowait() == []
+
+
+def test_hub_send_heartbeats(monkeypatch: pytest.MonkeyPatch) -> None:
+    hub = messages_module.BroadcastHub()
+    idle = hub.subscribe(8)
+    active = hub.subscribe(8)
+    busy = hub.subscribe(8)
+    busy.push([])
+    monkeypatch.setattr(time, 'monotonic', lambda: idle.active + 30)
+    active.active = idle.active + 20
+
+    hub.send_heartbeats(15)
+    assert idle.heartbeat is True
+    assert idle.queue.get_nowait() == []
+    assert active.heartbeat is False
+    assert active.queue.empty()
+    # Has events to send anyway
+    assert busy.heartbeat is False
+    assert busy.queue.qsize() == 1
+
+
+def test_send_heartbeats(
+    app: Flask,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    keep_alives: list[float] = []
+    hub = messages_module.BroadcastHub()
+    monkeypatch.setattr(hub, 'send_heartbeats', keep_alives.append)
+    monkeypatch.setattr(messages_module, 'hub', hub)
+    monkeypatch.setitem(app.config, 'STREAM_KEEP_ALIVE', 20)
+    delays: list[float] = []
+
+    def sleep(delay: float) -> None:
+        if len(delays) == 2:
+            raise gevent.GreenletExit
+
+        delays.append(delay)
+
+    monkeypatch.setattr(gevent, 'sleep', sleep)
+
+    with pytest.raises(gevent.GreenletExit):
+        messages_module.send_heartbeats(app)
+
+    assert delays == [10, 10]
+    assert keep_alives == [20, 20]
+
+
+def test_send_heartbeats_disabled(
+    app: Flask,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setitem(app.config, 'STREAM_KEEP_ALIVE', 0)
+    monkeypatch.setattr(messages_module, 'heartbeat_greenlet', None)
+    # Never ticking
+    monkeypatch.setattr(gevent, 'sleep', pytest.fail)
+
+    messages_module.send_heartbeats(app)
+
+    with app.app_context():
+        messages_module.ensure_listener_running()
+
+    assert messages_module.heartbeat_greenlet is None
+
+
+def test_get_notification_payload(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    messages: dict[str, MessageInfo] = {
+        'second': {
+            'id': 'second',
+            'date': '2025-01-01T00:00:01',
+            'author': 'Admin',
+            'channel': 'general',
+            'text': 'Second',
+        },
+        'first': {
+            'id': 'first',
+            'date': '2025-01-01T00:00:00',
+            'author': 'Admin',
+            'channel': 'general',
+            'text': 'First',
+        },
+    }
+
+    payload = json.loads(messages_module.get_notification_payload(
+        messages.values(),
+    ))
+    assert payload == {
+        'messages': [messages['first'], messages['second']],
+    }
+
+    monkeypatch.setattr(messages_module, 'NOTIFY_PAYLOAD_LIMIT', 100)
+    payload = json.loads(messages_module.get_notification_payload(
+        messages.values(),
+    ))
+    assert payload == {'ids': ['first', 'second']}
+
+    monkeypatch.setattr(messages_module, 'NOTIFY_PAYLOAD_LIMIT', 10)
+    assert messages_module.get_notification_payload(
+        messages.values(),
+    ) == ''
+
+
+def test_hub_dispatch(
+    db_session: scoped_session[Session],
+) -> None:
+    message = Message()
+    message.text = 'Dispatched'
+    db_session.add(message)
+    db_session.flush()
+
+    hub = messages_module.BroadcastHub()
+    subscriber = hub.subscribe(8)
+
+    hub.dispatch(json.dumps({'ids': [str(message.id)]}))
+    [event] = subscriber.queue.get_nowait()
+    assert event.id == str(message.id)
+    assert event.date == message.date
+    assert event.frame.startswith(
+        f'id: {message.id}\nevent: created\ndata: '.encode(),
+    )
+    assert parse_frame(event.frame)['text'] == 'Dispatched'
+
+    hub.dispatch(json.dumps({
+        'messages': [parse_frame(event.frame)],
+    }))
+    assert subscriber.queue.get_nowait() == [event]
+
+    # Not started yet, streams have to catch up by themselves
+    hub.dispatch('')
+    assert subscriber.queue.get_nowait() == []
+    assert subscriber.gap is True
+
+    hub.unsubscribe(subscriber)
+    assert not hub.subscribers
+
+
+def test_hub_channels() -> None:
+    hub = messages_module.BroadcastHub()
+    general = hub.subscribe(8)
+    random = hub.subscribe(8, 'random')
+    events = [
+        messages_module.MessageEvent(
+            str(uuid.UUID(int=index)),
+            datetime.datetime(2000, 1, 1),
+            b'',
+            'created',
+            channel,
+        )
+        for index, channel in enumerate(('random', 'general', 'random'))
+    ]
+
+    hub.broadcast(events)
+    assert general.queue.get_nowait() == [events[1]]
+    assert random.queue.get_nowait() == [events[0], events[2]]
+
+    hub.broadcast(events[:1])
+    assert general.queue.empty()
+    assert random.queue.get_nowait() == events[:1]
+
+    # Catching up concerns every channel
+    hub.broadcast(None)
+    assert general.gap and random.gap
+
+    hub.unsubscribe(random)
+    assert list(hub.channels) == ['general']
+    hub.unsubscribe(general)
+    assert not hub.channels
+
+
+def test_hub_start(
+    db_session: scoped_session[Session],
+    add_message: AddMessage,
+) -> None:
+    message = add_message('Latest', datetime.datetime(2000, 1, 1))
+
+    hub = messages_module.BroadcastHub()
+    subscriber = hub.subscribe(8)
+    hub.start()
+    assert hub.cursor
+    assert hub.cursor.date == message.date
+    assert hub.cursor.id == str(message.id)
+    assert subscriber.queue.get_nowait() == []
+    assert subscriber.gap is True
+
+    subscriber.gap = False
+    new_message = add_message(
+        'Missed',
+        datetime.datetime(2000, 1, 2),
+    )
+
+    # Restarting only publishes what was missed
+    hub.start()
+    [event] = subscriber.queue.get_nowait()
+    assert event.id == str(new_message.id)
+    assert subscriber.gap is False
+
+
+def make_message_info(message_id: str, channel: str) -> MessageInfo:
+    return {
+        'id': message_id,
+        'date': '2025-01-01T00:00:00',
+        'author': 'Admin',
+        'channel': channel,
+        'text': 'Some text',
+    }
+
+
+def test_notify_message_changes(
     monkeypatch: pytest.MonkeyPatch,
 ) -> None:
     executed: list[tuple[str, dict[str, str]]] = []
@@ -161,79 +1329,289 @@ def test_trigger_message_notifications(
     monkeypatch.setattr(
         db.engine,
         'begin',
-        lambda: Transaction(),
+        Transaction,
     )
 
-    session = SimpleNamespace(
-        info={messages_module.SESSION_MESSAGES_CHANGED_KEY: True},
+    message = make_message_info('id', 'general')
+    messages_module.notify_message_changes(
+        changes_module.Changes(created={'id': message}),
     )
-    messages_module.trigger_message_notifications(session)
-
-    assert session.info == {}
     assert executed == [(
         'SELECT pg_notify(:channel, :payload)',
-        {'channel': messages_module.MESSAGES_CHANNEL, 'payload': ''},
+        {
+            'channel': messages_module.MESSAGES_CHANNEL,
+            'payload': json.dumps({'messages': [message]}),
+        },
     )]
 
+    messages_module.notify_message_changes(changes_module.Changes())
+    assert len(executed) == 1
+
+
+def test_notify_message_change_events(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    payloads: list[str] = []
+    monkeypatch.setattr(messages_module, 'notify_messages', payloads.append)
+    monkeypatch.setattr(messages_module, 'NOTIFY_IDS_CHUNK_SIZE', 2)
+    messages_module.notify_message_changes(changes_module.Changes(
+        updated={'a': make_message_info('a', 'general')},
+        deleted={
+            message_id: make_message_info(message_id, channel)
+            for message_id, channel in (
+                ('e', 'general'),
+                ('d', 'random'),
+                ('b', 'general'),
+                ('c', 'general'),
+            )
+        },
+    ))
+    assert [json.loads(payload) for payload in payloads] == [
+        {'updated': ['a'], 'channel': 'general'},
+        {'deleted': ['b', 'c'], 'channel': 'general'},
+        {'deleted': ['e'], 'channel': 'general'},
+        {'deleted': ['d'], 'channel': 'random'},
+    ]
+
+
+def test_message_changes(
+    db_session: scoped_session[Session],
+    add_message: AddMessage,
+) -> None:
+    session = db_session()
+    changes_module.clear_changes(session)
+    changes = messages_module.message_changes.pending(session)
+
+    message = Message()
+    message.text = 'Tracked'
+    db_session.add(message)
+    db_session.flush()
+    assert changes.created[message.id]['text'] == 'Tracked'
+    assert changes.created[message.id]['author'] == 'Admin'
+
+    # Not announced yet, only the latest version is
+    message.text = 'Edited'
+    db_session.flush()
+    assert changes.created[message.id]['text'] == 'Edited'
+    assert changes.updated == {}
+
+    db_session.delete(message)
+    db_session.flush()
+    assert changes.created == {}
+    assert changes.deleted == {}
+
+    announced = add_message('Announced', datetime.datetime.now())
+    changes_module.clear_changes(session)
+    changes = messages_module.message_changes.pending(session)
+    db_session.flush()
+    assert changes.updated == {}
+
+    announced.text = 'Edited'
+    db_session.flush()
+    assert changes.updated[announced.id]['channel'] == 'general'
+
+    db_session.delete(announced)
+    db_session.flush()
+    assert changes.updated == {}
+    assert changes.deleted[announced.id]['id'] == str(announced.id)
+    assert changes.created == {}
+    changes_module.clear_changes(session)
+
+
+class ListenConnection:
+    def __init__(self) -> None:
+        self.notifies = [SimpleNamespace(payload='payload')]
+        self.statement = ''
+        self.detached = False
+        self.closed = False
+        self.committed = False
+
+    def detach(self) -> None:
+        self.detached = True
+
+    def cursor(self) -> ListenConnection:
+        return self
+
+    def execute(self, sql: str) -> None:
+        self.statement = sql
+
+    def commit(self) -> None:
+        self.committed = True
+
+    def fileno(self) -> int:
+        return 42
+
+    def poll(self) -> None:
+        return None
+
+    def close(self) -> None:
+        self.closed = True
+
 
 def test_listen_notifications(
     app: Flask,
     monkeypatch: pytest.MonkeyPatch,
 ) -> None:
-    full_queue: gevent.queue.Queue[None] = gevent.queue.Queue(maxsize=1)
-    full_queue.put_nowait(None)
-    ready_queue: gevent.queue.Queue[None] = gevent.queue.Queue(maxsize=1)
-    monkeypatch.setattr(
-        messages_module,
-        'subscriber_queues',
-        {full_queue, ready_queue},
-    )
+    hub_calls: list[str] = []
+    hub = messages_module.BroadcastHub()
+    monkeypatch.setattr(hub, 'start', lambda: hub_calls.append('start'))
+    monkeypatch.setattr(hub, 'dispatch', hub_calls.append)
 
-    class Connection:
-        def __init__(self) -> None:
-            self.notifies = [object()]
-            self.statement = ''
-            self.closed = False
-            self.committed = False
+    connection = ListenConnection()
+    connections = [connection]
 
-        def cursor(self) -> Connection:
-            return self
+    def raw_connection() -> ListenConnection:
+        if not connections:
+            raise RuntimeError('database down')
 
-        def execute(self, sql: str) -> None:
-            self.statement = sql
+        return connections.pop()
 
-        def commit(self) -> None:
-            self.committed = True
+    monkeypatch.setattr(db.engine, 'raw_connection', raw_connection)
 
-        def poll(self) -> None:
-            return None
+    waited: list[int] = []
 
-        def close(self) -> None:
-            self.closed = True
+    def wait_read(fileno: int) -> None:
+        if waited:
+            raise OSError('connection lost')
 
-    connection = Connection()
-    monkeypatch.setattr(
-        db.engine,
-        'raw_connection',
-        lambda: connection,
-    )
+        waited.append(fileno)
 
-    logged: list[str] = []
+    monkeypatch.setattr(messages_module, 'wait_read', wait_read)
 
-    def stop_loop(_: float) -> None:
-        raise RuntimeError('stop')
+    delays: list[float] = []
 
-    with app.app_context():
-        monkeypatch.setattr(gevent, 'sleep', stop_loop)
-        monkeypatch.setattr(app.logger, 'exception', logged.append)
-        messages_module.listen_notifications()
+    def sleep(delay: float) -> None:
+        delays.append(delay)
+
+        if len(delays) == 3:
+            raise gevent.GreenletExit
+
+    monkeypatch.setitem(app.config, 'LISTENER_RECONNECT_DELAY', 1)
+    monkeypatch.setitem(app.config, 'LISTENER_RECONNECT_MAX_DELAY', 3)
+    monkeypatch.setattr(gevent, 'sleep', sleep)
+    logged: list[str] = []
+    monkeypatch.setattr(app.logger, 'exception', logged.append)
+
+    with pytest.raises(gevent.GreenletExit):
+        messages_module.listen_notifications(app, hub, None)
 
     assert connection.statement == (
         f'LISTEN {messages_module.MESSAGES_CHANNEL};'
     )
+    assert connection.detached is True
     assert connection.committed is True
     assert connection.closed is True
-    assert full_queue.qsize() == 1
-    assert ready_queue.qsize() == 1
-    assert logged == ['Message notification listener stopped']
+    assert waited == [42]
+    assert hub_calls == ['start', 'payload']
+    # Exponential backoff while the database is unreachable
+    assert delays == [1, 2, 3]
+    assert logged == ['Message notification listener stopped'] * 3
     assert messages_module.listener_greenlet is None
+
+
+def test_listen_notifications_backoff(
+    app: Flask,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    hub = messages_module.BroadcastHub()
+    monkeypatch.setattr(hub, 'start', lambda: None)
+    monkeypatch.setattr(db.engine, 'raw_connection', ListenConnection)
+    now = [0.]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    # Connections lost right away, then after a while
+    lifetimes = [0, 0, 5]
+
+    def wait_read(fileno: int) -> None:
+        now[0] += lifetimes.pop(0)
+        raise OSError('connection lost')
+
+    monkeypatch.setattr(messages_module, 'wait_read', wait_read)
+    delays: list[float] = []
+
+    def sleep(delay: float) -> None:
+        delays.append(delay)
+        now[0] += delay
+
+        if not lifetimes:
+            raise gevent.GreenletExit
+
+    monkeypatch.setitem(app.config, 'LISTENER_RECONNECT_DELAY', 1)
+    monkeypatch.setitem(app.config, 'LISTENER_RECONNECT_MAX_DELAY', 3)
+    monkeypatch.setattr(gevent, 'sleep', sleep)
+    monkeypatch.setattr(app.logger, 'exception', lambda message: None)
+
+    with pytest.raises(gevent.GreenletExit):
+        messages_module.listen_notifications(app, hub, None)
+
+    assert delays == [1, 2, 1]
+
+
+def test_receive_notifications_invalid(
+    app: Flask,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    connection = ListenConnection()
+    connection.notifies = [
+        SimpleNamespace(payload='not from this app'),
+        SimpleNamespace(payload=''),
+    ]
+    hub = messages_module.BroadcastHub()
+    dispatched: list[str] = []
+
+    def dispatch(payload: str) -> None:
+        dispatched.append(payload)
+        json.loads(payload or '{}')
+
+    monkeypatch.setattr(hub, 'dispatch', dispatch)
+    waited: list[int] = []
+
+    def wait_read(fileno: int) -> None:
+        if waited:
+            raise OSError('connection lost')
+
+        waited.append(fileno)
+
+    monkeypatch.setattr(messages_module, 'wait_read', wait_read)
+
+    with pytest.raises(OSError):
+        messages_module.receive_notifications(
+            app,
+            cast(messages_module.NotificationConnection, connection),
+            hub,
+        )
+
+    # Following notifications are still dispatched
+    assert dispatched == ['not from this app', '']
+    assert caplog.messages == [
+        "Message notification dropped: 'not from this app'",
+    ]
+
+
+def test_messages_stream_compressed(
+    test_client: FlaskClient,
+    admin_session: None,
+    loopback_notifications: Callable[[], None],
+) -> None:
+    response = test_client.get(
+        '/messages',
+        headers={'Accept-Encoding': 'gzip'},
+    )
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    response_iterator = response.iter_encoded()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def next_frame() -> bytes:
+        # Every chunk is flushed, readable without waiting for the next one
+        return decompressor.decompress(next(response_iterator))
+
+    for _ in Message.query:
+        next_frame()
+
+    assert next_frame() == b':heartbeat\n'
+    response = test_client.post('/messages', json={'text': 'Some text'})
+    loopback_notifications()
+    data = parse_frame(next_frame())
+    assert data['id'] == response.get_json()['id']
+    assert next_frame() == b':heartbeat\n'
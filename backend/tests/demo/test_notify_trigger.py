@@ -0,0 +1,145 @@
+import datetime
+import json
+from collections.abc import Callable
+from types import ModuleType
+from typing import Any
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.orm import scoped_session
+
+from backend.demo import messages as messages_module
+from backend.model.changes import Changes
+from tests.conftest import AddMessage
+
+MIGRATION = 'd2f6b8e1c047_add_message_notify_triggers'
+
+
+@pytest.fixture
+def notifications(
+    app: Flask,
+    db_session: scoped_session[Session],
+    monkeypatch: pytest.MonkeyPatch,
+    load_migration: Callable[[str], ModuleType],
+) -> Callable[[], list[Any]]:
+    migration = load_migration(MIGRATION)
+    connection = db_session.connection()
+    monkeypatch.setitem(app.config, 'MESSAGE_NOTIFY_TRIGGER', True)
+
+    with Operations.context(MigrationContext.configure(connection)):
+        migration.upgrade()
+
+    # Nothing is ever committed, payloads are kept for the test instead
+    connection.execute(text(
+        'CREATE TEMPORARY TABLE notification (channel text, payload text)'
+    ))
+    connection.execute(text(
+        'CREATE FUNCTION public.pg_notify(channel text, payload text) '
+        'RETURNS void LANGUAGE sql '
+        'AS $$ INSERT INTO notification VALUES (channel, payload) $$'
+    ))
+    connection.execute(text('SET LOCAL search_path = public, pg_catalog'))
+
+    def get_payloads() -> list[Any]:
+        return [
+            json.loads(payload)
+            for channel, payload in connection.execute(text(
+                'DELETE FROM notification RETURNING channel, payload'
+            ))
+            if channel == messages_module.MESSAGES_CHANNEL
+        ]
+
+    return get_payloads
+
+
+def test_notify_trigger(
+    db_session: scoped_session[Session],
+    notifications: Callable[[], list[Any]],
+    add_message: AddMessage,
+) -> None:
+    messages = [
+        add_message('Exact', datetime.datetime(3000, 1, 1)),
+        add_message(
+            'Précis',
+            datetime.datetime(3000, 1, 1, 0, 0, 1, 120),
+        ),
+    ]
+    # Same payloads as the application would send
+    assert notifications() == [
+        json.loads(messages_module.get_notification_payload([
+            messages_module.dump_message(message),
+        ]))
+        for message in messages
+    ]
+
+    messages[0].text = 'Edited'
+    db_session.flush()
+    assert notifications() == [
+        {'updated': [str(messages[0].id)], 'channel': 'general'},
+    ]
+
+    db_session.delete(messages[1])
+    db_session.flush()
+    assert notifications() == [
+        {'deleted': [str(messages[1].id)], 'channel': 'general'},
+    ]
+
+    # Statements without rows notify nothing
+    db_session.execute(text("DELETE FROM message WHERE text = 'Missing'"))
+    assert notifications() == []
+
+
+def test_notify_trigger_bulk(
+    test_client: FlaskClient,
+    admin_session: None,
+    notifications: Callable[[], list[Any]],
+) -> None:
+    response = test_client.post('/messages/batch', json={'messages': [
+        {'text': 'Bulk ' * 20, 'channel': channel}
+        for channel in ['general'] * 151 + ['random'] * 2
+    ]})
+    assert response.status_code == 201
+    ids = response.get_json()['ids']
+    # Too big for a payload, chunked IDs are sent instead
+    payloads = notifications()
+    assert [
+        (payload['channel'], len(payload['ids'])) for payload in payloads
+    ] == [('general', 150), ('general', 1), ('random', 2)]
+    assert sorted(
+        message_id for payload in payloads for message_id in payload['ids']
+    ) == sorted(ids)
+
+    response = test_client.delete('/messages', query_string={
+        'channel': 'random',
+    })
+    assert response.status_code == 200
+    assert notifications() == [
+        {'deleted': sorted(ids[-2:]), 'channel': 'random'},
+    ]
+
+
+def test_notify_message_changes_with_trigger(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    payloads: list[str] = []
+    monkeypatch.setattr(messages_module, 'notify_messages', payloads.append)
+    monkeypatch.setattr(messages_module, 'notify_trigger', None)
+    # Not installed in the test database
+    assert messages_module.has_notify_trigger() is False
+
+    monkeypatch.setattr(messages_module, 'notify_trigger', True)
+    messages_module.notify_message_changes(Changes(deleted={
+        'id': {
+            'id': 'id',
+            'date': '2000-01-01T00:00:00',
+            'author': 'Admin',
+            'channel': 'general',
+            'text': 'Deleted',
+        },
+    }))
+    assert payloads == []
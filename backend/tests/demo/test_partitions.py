@@ -0,0 +1,244 @@
+import datetime
+from collections.abc import Callable
+from types import ModuleType
+from typing import cast
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from flask import Flask
+from flask_sqlalchemy.session import Session
+from sqlalchemy import select, text
+from sqlalchemy.orm import scoped_session
+
+from backend.demo import partitions as partitions_module
+from backend.demo.messages import StreamCursor
+from backend.demo.model.message import Message
+from tests.conftest import AddMessage
+
+MIGRATION = 'c5a7e3d91f02_partition_message_table_by_month'
+# Undone then redone around the partitioning migration
+LATER_MIGRATIONS = [
+    'e4b2f0c6a813_add_message_search_column',
+    'a9d3c71e5b24_add_message_channel',
+    'd2f6b8e1c047_add_message_notify_triggers',
+]
+
+
+@pytest.fixture
+def migrate(
+    db_session: scoped_session[Session],
+    load_migration: Callable[[str], ModuleType],
+) -> Callable[[str], None]:
+    migration = load_migration(MIGRATION)
+    later_migrations = [load_migration(name) for name in LATER_MIGRATIONS]
+
+    def run(direction: str) -> None:
+        context = MigrationContext.configure(db_session.connection())
+
+        with Operations.context(context):
+            for later_migration in reversed(later_migrations):
+                later_migration.downgrade()
+
+            getattr(migration, direction)()
+
+            for later_migration in later_migrations:
+                later_migration.upgrade()
+
+    return run
+
+
+def at_noon(date: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(date, datetime.time(12))
+
+
+def get_partition(
+    db_session: scoped_session[Session],
+    message: Message,
+) -> str | None:
+    return cast(str | None, db_session.scalar(
+        text('SELECT tableoid::regclass::text FROM message WHERE id = :id'),
+        {'id': message.id},
+    ))
+
+
+@pytest.mark.parametrize(('date', 'offset', 'month'), [
+    (datetime.date(2024, 1, 31), 0, datetime.date(2024, 1, 1)),
+    (datetime.date(2024, 12, 15), 1, datetime.date(2025, 1, 1)),
+    (datetime.date(2024, 1, 1), -1, datetime.date(2023, 12, 1)),
+    (datetime.date(2024, 3, 1), -27, datetime.date(2021, 12, 1)),
+])
+def test_month_start(
+    date: datetime.date,
+    offset: int,
+    month: datetime.date,
+) -> None:
+    assert partitions_module.month_start(date, offset) == month
+
+
+def test_partition_migration(
+    app: Flask,
+    db_session: scoped_session[Session],
+    migrate: Callable[[str], None],
+    monkeypatch: pytest.MonkeyPatch,
+    add_message: AddMessage,
+) -> None:
+    today = datetime.date.today()
+    old_month = partitions_module.month_start(today, -24)
+    old_message = add_message('Sent', at_noon(old_month))
+    connection = db_session.connection()
+
+    # Opt-in only
+    migrate('upgrade')
+    assert not partitions_module.is_partitioned(connection)
+
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONING', True)
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONS_AHEAD', 2)
+    migrate('upgrade')
+    assert partitions_module.is_partitioned(connection)
+    months = partitions_module.get_partitions(connection)
+    assert months[0] == old_month
+    assert months[-1] == partitions_module.month_start(today, 2)
+    assert len(months) == 27
+    assert get_partition(db_session, old_message) == (
+        partitions_module.get_partition_name(old_month)
+    )
+
+    message = add_message('Sent', at_noon(today))
+    assert get_partition(db_session, message) == (
+        partitions_module.get_partition_name(today.replace(day=1))
+    )
+    far_future = add_message('Sent', at_noon(datetime.date(3000, 1, 1)))
+    assert get_partition(db_session, far_future) == 'message_default'
+
+    migrate('downgrade')
+    assert not partitions_module.is_partitioned(connection)
+    assert get_partition(db_session, old_message) == 'message'
+    assert db_session.scalar(
+        text("SELECT to_regclass('ix_message_date_id') IS NOT NULL"),
+    )
+
+
+def test_partition_pruning(
+    app: Flask,
+    db_session: scoped_session[Session],
+    migrate: Callable[[str], None],
+    monkeypatch: pytest.MonkeyPatch,
+    add_message: AddMessage,
+) -> None:
+    today = datetime.date.today()
+    old_month = partitions_module.month_start(today, -3)
+    add_message('Sent', at_noon(old_month))
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONING', True)
+    migrate('upgrade')
+
+    message = add_message('Sent', at_noon(today))
+    cursor = StreamCursor()
+    cursor.advance(str(message.id), message.date)
+    query = select(Message.id).where(cursor.after()).compile(
+        db_session.get_bind(),
+        compile_kwargs={'literal_binds': True},
+    )
+    plan = '\n'.join(db_session.scalars(text(f'EXPLAIN {query}')))
+    assert partitions_module.get_partition_name(today.replace(day=1)) in plan
+    assert partitions_module.get_partition_name(old_month) not in plan
+
+
+def test_maintain_partitions(
+    app: Flask,
+    db_session: scoped_session[Session],
+    migrate: Callable[[str], None],
+    monkeypatch: pytest.MonkeyPatch,
+    add_message: AddMessage,
+) -> None:
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['demo', 'partitions'])
+    assert result.exit_code == 1
+    assert 'The message table is not partitioned' in result.output
+
+    today = datetime.date.today()
+    months = [partitions_module.month_start(today, -offset) for offset in (
+        8,
+        7,
+        5,
+    )]
+
+    for month in months:
+        add_message('Sent', at_noon(month))
+
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONING', True)
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONS_AHEAD', 0)
+    migrate('upgrade')
+    connection = db_session.connection()
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONS_AHEAD', 1)
+    next_month = partitions_module.month_start(today, 1)
+
+    # No retention by default
+    result = runner.invoke(args=['demo', 'partitions'])
+    assert result.exit_code == 0, result.output
+    assert result.output == (
+        f'Created {partitions_module.get_partition_name(next_month)}\n'
+    )
+
+    # Partitions go once all their messages are older than the retention
+    result = runner.invoke(args=['demo', 'partitions', '--retention', '7'])
+    assert result.exit_code == 0, result.output
+    name = partitions_module.get_partition_name(months[0])
+    assert result.output == f'Dropped {name}\n'
+
+    monkeypatch.setitem(app.config, 'MESSAGE_RETENTION_MONTHS', 6)
+    result = runner.invoke(args=['demo', 'partitions', '--detach'])
+    assert result.exit_code == 0, result.output
+    name = partitions_module.get_partition_name(months[1])
+    assert result.output == f'Detached {name}\n'
+    assert partitions_module.get_partitions(connection)[0] == (
+        partitions_module.month_start(today, -6)
+    )
+    # Kept as a standalone table
+    assert db_session.scalar(text(f'SELECT count(*) FROM {name}')) == 1
+    assert db_session.scalar(
+        select(Message.date).order_by(Message.date).limit(1),
+    ) == datetime.datetime.combine(months[2], datetime.time(12))
+
+
+def test_maintain_partitions_stranded(
+    app: Flask,
+    db_session: scoped_session[Session],
+    migrate: Callable[[str], None],
+    monkeypatch: pytest.MonkeyPatch,
+    add_message: AddMessage,
+) -> None:
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONING', True)
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONS_AHEAD', 0)
+    migrate('upgrade')
+
+    # Sent while maintenance lapsed
+    today = datetime.date.today()
+    next_month = partitions_module.month_start(today, 1)
+    stranded = [add_message('Sent', at_noon(next_month)) for _ in range(2)]
+    later = add_message(
+        'Later',
+        at_noon(partitions_module.month_start(today, 2)),
+    )
+    assert get_partition(db_session, stranded[0]) == 'message_default'
+
+    monkeypatch.setitem(app.config, 'MESSAGE_PARTITIONS_AHEAD', 1)
+    result = app.test_cli_runner().invoke(args=['demo', 'partitions'])
+    assert result.exit_code == 0, result.output
+    name = partitions_module.get_partition_name(next_month)
+    assert result.output == (
+        f'Created {name}, moved 2 messages from message_default\n'
+    )
+
+    for message in stranded:
+        assert get_partition(db_session, message) == name
+        # Still searchable
+        assert db_session.scalar(
+            text('SELECT search IS NOT NULL FROM message WHERE id = :id'),
+            {'id': message.id},
+        )
+
+    # Attached again
+    assert get_partition(db_session, later) == 'message_default'
+    far_future = add_message('Sent', at_noon(datetime.date(3000, 1, 1)))
+    assert get_partition(db_session, far_future) == 'message_default'
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from typing import Any, cast
+
+import pytest
+from flask_sqlalchemy.session import Session
+from sqlalchemy.orm import scoped_session
+
+from backend.model.changes import (
+    SESSION_CHANGES_KEY,
+    Changes,
+    clear_changes,
+    publish_changes,
+)
+from backend.model.file import File, file_changes
+
+
+def test_changes() -> None:
+    changes: Changes[str] = Changes()
+    changes.create('created', 'v1')
+    changes.update('created', 'v2')
+    changes.update('updated', 'v1')
+    changes.update('updated', 'v2')
+    changes.delete('gone', 'v1')
+    assert changes == Changes(
+        created={'created': 'v2'},
+        updated={'updated': 'v2'},
+        deleted={'gone': 'v1'},
+    )
+
+    changes.delete('created', 'v2')
+    changes.delete('updated', 'v2')
+    assert changes == Changes(
+        deleted={'updated': 'v2', 'gone': 'v1'},
+    )
+
+
+def test_publish_changes(
+    db_session: scoped_session[Session],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    session = db_session()
+    session.info.pop(SESSION_CHANGES_KEY, None)
+    published: list[Changes[Any]] = []
+    monkeypatch.setattr(file_changes, 'subscribers', [published.append])
+
+    file = File()
+    file.filename = 'published.pdf'
+    file.original_filename = 'published.pdf'
+    db_session.add(file)
+    db_session.flush()
+    publish_changes(session)
+    assert published == [Changes(created={file.id: file.path})]
+    assert SESSION_CHANGES_KEY not in session.info
+
+    # Unchanged instances aren't updates
+    db_session.add(file)
+    db_session.flush()
+    publish_changes(session)
+    assert len(published) == 1
+
+    file.original_filename = 'renamed.pdf'
+    db_session.flush()
+    clear_changes(session)
+    publish_changes(session)
+    assert len(published) == 1
+
+    # Sessions without changes have nothing to publish
+    publish_changes(cast(Session, SimpleNamespace(info={})))
@@ -0,0 +1,110 @@
+import gzip
+import zlib
+from collections.abc import Callable, Iterator
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from backend.compression import HAS_BROTLI, ZlibCompressor, compress_stream
+
+DECOMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    'gzip': gzip.decompress,
+    'deflate': zlib.decompress,
+}
+
+if HAS_BROTLI:
+    import brotli  # type: ignore
+    DECOMPRESSORS['br'] = brotli.decompress
+
+
+@pytest.fixture
+def compress_all(app: Flask, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(app.config, 'COMPRESSION_MIN_SIZE', 0)
+
+
+@pytest.mark.parametrize('encoding', DECOMPRESSORS)
+def test_compression(
+    test_client: FlaskClient,
+    admin_session: None,
+    compress_all: None,
+    encoding: str,
+) -> None:
+    expected = test_client.get('/auth').get_data()
+    response = test_client.get('/auth', headers={'Accept-Encoding': encoding})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.vary
+    assert DECOMPRESSORS[encoding](response.get_data()) == expected
+    assert response.content_length == len(response.get_data())
+
+
+def test_compression_negotiation(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    compress_all: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def get_encoding(accept_encoding: str) -> str | None:
+        return test_client.get(
+            '/auth',
+            headers={'Accept-Encoding': accept_encoding},
+        ).headers.get('Content-Encoding')
+
+    monkeypatch.setitem(app.config, 'COMPRESSION_ENCODINGS', [
+        'br',
+        'gzip',
+        'deflate',
+    ])
+    assert get_encoding('deflate, gzip') == 'gzip'
+    assert get_encoding('gzip;q=0.5, deflate') == 'deflate'
+    assert get_encoding('gzip;q=0, *') == ('br' if HAS_BROTLI else 'deflate')
+    assert get_encoding('identity') is None
+    assert get_encoding('compress') is None
+
+    monkeypatch.setitem(app.config, 'COMPRESSION_ENCODINGS', [''])
+    assert get_encoding('gzip') is None
+
+    # Small responses are left alone
+    monkeypatch.setitem(app.config, 'COMPRESSION_ENCODINGS', ['gzip'])
+    monkeypatch.setitem(app.config, 'COMPRESSION_MIN_SIZE', 1024)
+    response = test_client.get('/auth', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' not in response.vary
+
+    # So are bodies which aren't compressible or empty
+    monkeypatch.setitem(app.config, 'COMPRESSION_MIN_SIZE', 0)
+    response = test_client.get('/deauth', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 204
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compress_stream() -> None:
+    closed = False
+
+    def body() -> Iterator[bytes | str]:
+        nonlocal closed
+
+        try:
+            yield 'first'
+            yield b''
+            yield b'second'
+
+        finally:
+            closed = True
+
+    decompressor = zlib.decompressobj()
+    chunks = compress_stream(body(), ZlibCompressor(zlib.MAX_WBITS))
+    assert decompressor.decompress(next(chunks)) == b'first'
+    assert decompressor.decompress(next(chunks)) == b'second'
+    assert decompressor.decompress(next(chunks)) == b''
+    assert decompressor.eof
+    assert closed
+
+    # Closing the compressed stream closes the body
+    closed = False
+    chunks = compress_stream(body(), ZlibCompressor(zlib.MAX_WBITS))
+    next(chunks)
+    chunks.close()  # type: ignore[attr-defined]
+    assert closed
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
+import hashlib
 from io import BytesIO
 from pathlib import Path
-from unittest.mock import Mock
 
 import pytest
 from flask import Flask
@@ -10,10 +10,18 @@ from flask.testing import FlaskClient
 from flask_sqlalchemy.session import Session
 from sqlalchemy.orm import scoped_session
 
+from backend.model import db
+from backend.model.changes import (
+    SESSION_CHANGES_KEY,
+    Changes,
+    publish_changes,
+)
 from backend.model.file import (
     File,
     FileConverter,
-    mark_deleted_files,
+    file_changes,
+    get_upload_path,
+    move_created_files,
     unlink_deleted_files,
 )
 from backend.model.user import User
@@ -41,25 +49,30 @@ def test_upload_file_invalid_file(
     assert response.json == {'message': 'invalid_file'}
 
 
-def test_upload_file_success(
-    test_client: FlaskClient,
-    admin_session: None,
-    monkeypatch: pytest.MonkeyPatch,
-    tmp_path: Path,
-) -> None:
+PDF = b'%PDF-1.7\n1 0 obj\n<<>>\nendobj\n' + b' ' * 4096
+
+
+@pytest.fixture
+def files_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
     monkeypatch.setattr(
         File,
         'path',
         property(lambda self: tmp_path / self.filename),
     )
+    return tmp_path
 
+
+def test_upload_file_success(
+    test_client: FlaskClient,
+    admin_session: None,
+    db_session: scoped_session[Session],
+    files_path: Path,
+) -> None:
     response = test_client.post(
         '/files',
         data={
-            'file': (
-                BytesIO(b'%PDF-1.7\n1 0 obj\n<<>>\nendobj\n'),
-                'report.pdf',
-            ),
+            'name': 'ignored',
+            'file': (BytesIO(PDF), 'report.pdf'),
         },
         content_type='multipart/form-data',
     )
@@ -68,6 +81,124 @@ def test_upload_file_success(
     data = response.get_json()
     assert isinstance(data, dict)
     assert data['filename'].endswith('.pdf')
+    file = db_session.query(File).filter_by(
+        filename=data['filename'],
+    ).one()
+    assert file.original_filename == 'report.pdf'
+    assert file.size == len(PDF)
+    assert file.sha256 == hashlib.sha256(PDF).hexdigest()
+
+    # Only in place once committed
+    assert list(files_path.iterdir()) == [get_upload_path(file.path)]
+    publish_changes(db_session())
+    assert list(files_path.iterdir()) == [file.path]
+    assert file.path.read_bytes() == PDF
+
+
+def test_upload_file_too_large(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    files_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setitem(app.config, 'FILES_MAX_SIZE', 1024)
+
+    def read_body() -> None:
+        raise AssertionError('Body read')
+
+    response = test_client.post(
+        '/files',
+        data={'file': (BytesIO(PDF), 'report.pdf')},
+        content_type='multipart/form-data',
+        environ_overrides={'wsgi.input': read_body},
+    )
+    assert response.status_code == 413
+    assert response.json == {'message': 'file_too_large'}
+    assert list(files_path.iterdir()) == []
+
+
+def test_upload_file_too_large_chunked(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    files_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setitem(app.config, 'FILES_MAX_SIZE', len(PDF) * 2)
+    data = (
+        b'--boundary\r\n'
+        b'Content-Disposition: form-data; name="file"; '
+        b'filename="report.pdf"\r\n\r\n'
+        + PDF * 100
+        + b'\r\n--boundary--\r\n'
+    )
+    read: list[int] = []
+
+    class Body(BytesIO):
+        def read(self, size: int | None = -1) -> bytes:
+            chunk = super().read(size)
+            read.append(len(chunk))
+            return chunk
+
+    # No Content-Length, the limit is checked as the body goes
+    response = test_client.post(
+        '/files',
+        input_stream=Body(data),
+        content_type='multipart/form-data; boundary=boundary',
+        environ_overrides={
+            'CONTENT_LENGTH': '',
+            'wsgi.input_terminated': True,
+        },
+    )
+    assert response.status_code == 413
+    assert response.json == {'message': 'file_too_large'}
+    # Cut short while writing, what was written is gone
+    assert len(PDF) * 2 < sum(read) < len(data)
+    assert list(files_path.iterdir()) == []
+
+
+def test_upload_file_commit_failed(
+    test_client: FlaskClient,
+    admin_session: None,
+    files_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def commit() -> None:
+        # Written by then
+        assert len(list(files_path.iterdir())) == 1
+        raise OSError('Commit failed')
+
+    monkeypatch.setattr(db.session, 'commit', commit)
+
+    with pytest.raises(OSError, match='Commit failed'):
+        test_client.post(
+            '/files',
+            data={'file': (BytesIO(PDF), 'report.pdf')},
+            content_type='multipart/form-data',
+        )
+
+    assert list(files_path.iterdir()) == []
+
+
+def test_upload_file_truncated(
+    test_client: FlaskClient,
+    admin_session: None,
+    files_path: Path,
+) -> None:
+    response = test_client.post(
+        '/files',
+        data=(
+            b'--boundary\r\n'
+            b'Content-Disposition: form-data; name="file"; '
+            b'filename="report.pdf"\r\n\r\n'
+            + PDF
+        ),
+        content_type='multipart/form-data; boundary=boundary',
+    )
+    assert response.status_code == 400
+    assert response.json == {'message': 'expected_file'}
+    assert list(files_path.iterdir()) == []
 
 
 def test_delete_file_invalid_author(
@@ -117,6 +248,224 @@ def test_download_file(
     response.close()
 
 
+RANGE_DATA = b'0123456789abcdef'
+RANGE_SHA256 = hashlib.sha256(RANGE_DATA).hexdigest()
+
+
+@pytest.fixture
+def download_path(
+    db_session: scoped_session[Session],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> Path:
+    file = File()
+    file.filename = 'range.pdf'
+    file.original_filename = 'range.pdf'
+    file.size = len(RANGE_DATA)
+    file.sha256 = RANGE_SHA256
+    db_session.add(file)
+    db_session.flush()
+    path = tmp_path / file.filename
+    path.write_bytes(RANGE_DATA)
+    monkeypatch.setattr(File, 'path', property(lambda self: path))
+    return path
+
+
+def test_download_file_conditional(
+    test_client: FlaskClient,
+    download_path: Path,
+) -> None:
+    response = test_client.get('/files/range.pdf')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{RANGE_SHA256}"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'Content-Disposition' not in response.headers
+    last_modified = response.headers['Last-Modified']
+    response.close()
+
+    for headers in (
+        {'If-None-Match': f'"{RANGE_SHA256}"'},
+        {'If-None-Match': f'W/"other", "{RANGE_SHA256}"'},
+        {'If-Modified-Since': last_modified},
+    ):
+        response = test_client.get('/files/range.pdf', headers=headers)
+        assert response.status_code == 304
+        assert response.data == b''
+
+    # ETags take precedence over dates
+    response = test_client.get('/files/range.pdf', headers={
+        'If-None-Match': '"other"',
+        'If-Modified-Since': last_modified,
+    })
+    assert response.status_code == 200
+    assert response.data == b'0123456789abcdef'
+    response.close()
+
+
+def test_download_file_stored_size(
+    test_client: FlaskClient,
+    db_session: scoped_session[Session],
+    download_path: Path,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    file = db_session.query(File).filter_by(filename='range.pdf').one()
+    file.size = None
+    file.sha256 = None
+    db_session.flush()
+
+    # Uploaded before these were recorded
+    response = test_client.head('/files/range.pdf')
+    assert response.headers['ETag'] == '"range.pdf-16"'
+    assert response.content_length == 16
+
+    # Changed on disk since
+    file.size = 4
+    db_session.flush()
+    response = test_client.get('/files/range.pdf')
+    assert response.status_code == 500
+    assert caplog.messages == [
+        f'Size of {download_path.resolve()} is 16 bytes, 4 were uploaded',
+    ]
+
+
+@pytest.mark.parametrize(('byte_range', 'content_range', 'data'), [
+    ('bytes=2-5', 'bytes 2-5/16', b'2345'),
+    ('bytes=10-', 'bytes 10-15/16', b'abcdef'),
+    ('bytes=-3', 'bytes 13-15/16', b'def'),
+    ('bytes=12-100', 'bytes 12-15/16', b'cdef'),
+    # Unsatisfiable ranges are left out
+    ('bytes=1-4,20-30', 'bytes 1-4/16', b'1234'),
+])
+def test_download_file_range(
+    test_client: FlaskClient,
+    download_path: Path,
+    byte_range: str,
+    content_range: str,
+    data: bytes,
+) -> None:
+    response = test_client.get('/files/range.pdf', headers={
+        'Range': byte_range,
+    })
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == content_range
+    assert response.content_length == len(data)
+    assert response.mimetype == 'application/pdf'
+    assert response.data == data
+
+
+def test_download_file_multiple_ranges(
+    test_client: FlaskClient,
+    download_path: Path,
+) -> None:
+    response = test_client.get('/files/range.pdf', headers={
+        'Range': 'bytes=0-1,4-5,-2',
+    })
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    boundary = response.mimetype_params['boundary']
+    assert response.content_length == len(response.data)
+    assert response.data.split(f'--{boundary}'.encode()) == [
+        b'\r\n',
+        *(
+            b'\r\nContent-Type: application/pdf\r\n'
+            + f'Content-Range: bytes {byte_range}/16\r\n\r\n'.encode()
+            + data
+            + b'\r\n'
+            for byte_range, data in [
+                ('0-1', b'01'),
+                ('4-5', b'45'),
+                ('14-15', b'ef'),
+            ]
+        ),
+        b'--\r\n',
+    ]
+
+
+def test_download_file_range_ignored(
+    test_client: FlaskClient,
+    download_path: Path,
+) -> None:
+    for headers in (
+        {'Range': 'bytes=2-5', 'If-Range': '"other"'},
+        {'Range': 'lines=1-2'},
+        {'Range': 'bytes=5-2'},
+        {'Range': 'bytes=4-5,0-1'},
+    ):
+        response = test_client.get('/files/range.pdf', headers=headers)
+        assert response.status_code == 200
+        assert response.data == b'0123456789abcdef'
+        response.close()
+
+    response = test_client.get('/files/range.pdf', headers={
+        'Range': 'bytes=2-5',
+        'If-Range': f'"{RANGE_SHA256}"',
+    })
+    assert response.status_code == 206
+    assert response.data == b'2345'
+
+
+def test_download_file_range_not_satisfiable(
+    test_client: FlaskClient,
+    download_path: Path,
+) -> None:
+    response = test_client.get('/files/range.pdf', headers={
+        'Range': 'bytes=16-20,30-',
+    })
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */16'
+
+
+def test_download_file_head(
+    test_client: FlaskClient,
+    download_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def open_file(*args: object, **kwargs: object) -> None:
+        raise AssertionError('Opened file')
+
+    monkeypatch.setattr(Path, 'open', open_file)
+
+    response = test_client.head('/files/range.pdf')
+    assert response.status_code == 200
+    assert response.content_length == 16
+    assert response.headers['ETag'] == f'"{RANGE_SHA256}"'
+    assert response.data == b''
+
+    response = test_client.head('/files/range.pdf', headers={
+        'Range': 'bytes=0-1,4-5',
+    })
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert response.data == b''
+
+
+def test_download_file_offloaded(
+    app: Flask,
+    test_client: FlaskClient,
+    db_session: scoped_session[Session],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    file = File()
+    file.filename = 'offload.mp4'
+    file.original_filename = 'offload.mp4'
+    db_session.add(file)
+    db_session.flush()
+    path = tmp_path / file.filename
+    monkeypatch.setattr(File, 'path', property(lambda self: path))
+    monkeypatch.setitem(app.config, 'FILES_DOWNLOAD_MODE', 'x-accel-redirect')
+
+    # Never opened by the backend
+    response = test_client.get(f'/files/{file.filename}')
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == (
+        '/internal/files/offload.mp4'
+    )
+    assert response.mimetype == 'video/mp4'
+    assert response.data == b''
+    assert 'Content-Disposition' not in response.headers
+
+
 def test_download_file_not_found(
     test_client: FlaskClient,
 ) -> None:
@@ -125,42 +474,63 @@ def test_download_file_not_found(
     assert response.get_json() == {'message': 'file_not_found'}
 
 
-def test_mark_deleted_files_tracks_deleted_path(
+def test_file_changes_track_deleted_path(
     db_session: scoped_session[Session],
 ) -> None:
+    session = db_session()
+    session.info.pop(SESSION_CHANGES_KEY, None)
     file = File()
     file.filename = 'orphan.pdf'
     file.original_filename = 'orphan.pdf'
     db_session.add(file)
     db_session.flush()
+    db_session.delete(file)
+    db_session.flush()
+    # Never committed, nothing to unlink
+    assert file_changes.pending(session).deleted == {}
 
-    mark_deleted_files(Mock(), Mock(), file)
-
-    deleted_paths = db_session.info['deleted_file_paths']
-    assert isinstance(deleted_paths, list)
-    assert file.path in deleted_paths
-
-
-def test_mark_deleted_files_without_session() -> None:
+    session.info.pop(SESSION_CHANGES_KEY, None)
     file = File()
-    file.filename = 'no-session.pdf'
-    file.original_filename = 'no-session.pdf'
-    mark_deleted_files(Mock(), Mock(), file)
+    file.filename = 'committed.pdf'
+    file.original_filename = 'committed.pdf'
+    db_session.add(file)
+    db_session.flush()
+    session.info.pop(SESSION_CHANGES_KEY, None)
+    db_session.delete(file)
+    db_session.flush()
+    assert file_changes.pending(session).deleted == {file.id: file.path}
+    session.info.pop(SESSION_CHANGES_KEY, None)
 
 
-def test_unlink_deleted_files(
-    db_session: scoped_session[Session],
+def test_move_created_files(
+    app: Flask,
     tmp_path: Path,
+    caplog: pytest.LogCaptureFixture,
 ) -> None:
-    file_path = tmp_path / 'deleted.pdf'
-    file_path.write_bytes(b'temp')
+    uploaded = tmp_path / 'uploaded.pdf'
+    get_upload_path(uploaded).write_bytes(b'uploaded')
+    missing = tmp_path / 'missing.pdf'
 
-    session = db_session()
-    session.info['deleted_file_paths'] = [file_path]
-    unlink_deleted_files(session)
+    with app.app_context():
+        move_created_files(Changes(created={
+            'uploaded': uploaded,
+            'missing': missing,
+        }))
+
+    assert uploaded.read_bytes() == b'uploaded'
+    assert not get_upload_path(uploaded).exists()
+    assert not missing.exists()
+    assert caplog.messages == [f'Upload of {missing} went missing']
 
+
+def test_unlink_deleted_files(tmp_path: Path) -> None:
+    file_path = tmp_path / 'deleted.pdf'
+    file_path.write_bytes(b'temp')
+    unlink_deleted_files(Changes(deleted={'id': file_path}))
     assert not file_path.exists()
-    assert session.info == {}
+
+    # Already gone
+    unlink_deleted_files(Changes(deleted={'id': file_path}))
 
 
 def test_file_converter_to_url(app: Flask) -> None:
@@ -0,0 +1,163 @@
+import dataclasses
+import datetime
+import decimal
+import math
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+import pytest
+from flask import Flask, Response
+from flask.json.provider import DefaultJSONProvider
+from marshmallow import Schema, fields, post_dump
+
+from backend.demo.messages import MessageSchema
+from backend.demo.model.message import Message
+from backend.json_provider import JSONProvider
+from backend.model.user import Role, User
+from backend.schema import DumpPlan, get_dump_plan, get_schema
+from backend.schema.user import UserSchema
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+
+def render(
+    provider: DefaultJSONProvider,
+    *args: object,
+    **kwargs: object,
+) -> Response:
+    response = provider.response(*args, **kwargs)
+    assert isinstance(response, Response)
+    return response
+
+
+@pytest.mark.parametrize('value', [
+    {'b': 1, 'a': [True, False, None, 1.5, -3]},
+    {'text': 'quote " backslash \\ controls \n\t\x00\x1f\x7f / <b>'},
+    {'id': uuid.UUID(int=1), 'role': Role.ADMINISTRATOR},
+    {'date': datetime.datetime(2000, 1, 2, 3, 4, 5)},
+    {'day': datetime.date(2000, 1, 2), 'point': Point(1, 2)},
+    {'amount': decimal.Decimal('1.10')},
+    {'floats': [1e-05, 1e16, 0.1, -0.0, 1.5e300]},
+    {'nested': [{'float': 2.5}], 'point': Point(1, 2)},
+    # Left to the default provider
+    {'text': 'Café ☕ 😀'},
+    {1: 'integer key'},
+    {'big': 2 ** 64},
+    [],
+    'string',
+    None,
+])
+def test_json_provider_response(app: Flask, value: Any) -> None:
+    default_provider = DefaultJSONProvider(app)
+    provider = JSONProvider(app)
+    assert render(provider, value).get_data() == (
+        render(default_provider, value).get_data()
+    )
+    assert render(provider, value).mimetype == 'application/json'
+
+
+@pytest.mark.parametrize('value', [
+    math.nan,
+    {'a': [math.inf]},
+    {'b': -math.inf},
+])
+def test_json_provider_non_finite(app: Flask, value: Any) -> None:
+    provider = JSONProvider(app)
+
+    with pytest.raises(ValueError, match='not JSON compliant'):
+        render(provider, value)
+
+    with pytest.raises(ValueError, match='not JSON compliant'):
+        provider.dumps(value)
+
+
+def test_json_provider_response_options(
+    app: Flask,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    provider = JSONProvider(app)
+    assert render(provider, a=1, b=[2]).get_data() == b'{"a":1,"b":[2]}\n'
+
+    monkeypatch.setattr(provider, 'sort_keys', False)
+    assert render(provider, b=1, a=2).get_data() == b'{"b":1,"a":2}\n'
+
+    monkeypatch.setattr(provider, 'compact', False)
+    assert render(provider, a=1).get_data() == b'{\n  "a": 1\n}\n'
+
+    with pytest.raises(TypeError):
+        render(provider, object())
+
+
+def test_json_provider_loads(app: Flask) -> None:
+    provider = JSONProvider(app)
+    assert provider.loads('{"a": [1, "é"]}') == {'a': [1, 'é']}
+    assert provider.loads(b'{"a": null}') == {'a': None}
+    # Accepted by json.loads() only
+    assert math.isnan(provider.loads('[NaN]')[0])
+    assert provider.loads('{"a": 1.5}', parse_float=decimal.Decimal) == {
+        'a': decimal.Decimal('1.5'),
+    }
+
+    with pytest.raises(ValueError):
+        provider.loads('{')
+
+
+def make_message(author: User | None) -> Message:
+    message = Message()
+    message.id = uuid.UUID(int=1)
+    message.date = datetime.datetime(2000, 1, 1)
+    message.author = author
+    message.channel = 'general'
+    message.text = 'Text'
+    return message
+
+
+# Every schema dumped through a plan, see get_dump_plan() users
+@pytest.mark.parametrize(('schema_class', 'make_objects'), [
+    (UserSchema, lambda user, other_user: [user, other_user]),
+    (MessageSchema, lambda user, other_user: [
+        make_message(user),
+        make_message(None),
+    ]),
+])
+def test_dump_plan(
+    user: User,
+    other_user: User,
+    schema_class: type[Schema],
+    make_objects: Callable[[User, User], list[object]],
+) -> None:
+    schema = schema_class()
+    plan = get_dump_plan(schema_class)
+    assert get_dump_plan(schema_class) is plan
+    assert get_schema(schema_class) is get_schema(schema_class)
+    objects = make_objects(user, other_user)
+
+    for obj in objects:
+        assert plan.dump(obj) == schema.dump(obj)
+        assert list(plan.dump(obj)) == list(schema.dump(obj))
+
+    assert plan.dump_many(objects) == schema.dump(objects, many=True)
+
+
+def test_dump_plan_keys_and_hooks() -> None:
+    class RenamedSchema(Schema):
+        value = fields.Integer(data_key='renamed', attribute='number')
+
+    assert get_dump_plan(RenamedSchema).dump(
+        type('Object', (), {'number': '3'}),
+    ) == {'renamed': 3}
+
+    class HookedSchema(Schema):
+        value = fields.Integer()
+
+        @post_dump
+        def wrap(self, data: dict[str, Any], **kwargs: Any) -> dict[str, Any]:
+            return {'wrapped': data}
+
+    with pytest.raises(ValueError, match='HookedSchema has dump hooks'):
+        DumpPlan(HookedSchema())
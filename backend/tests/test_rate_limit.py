@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from collections.abc import Generator
+from io import BytesIO
+from pathlib import Path
+from typing import cast
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Connection, Engine, update
+from sqlalchemy.orm import scoped_session
+
+from backend.api import rate_limit as rate_limit_module
+from backend.api.rate_limit import (
+    DatabaseBuckets,
+    SharedBuckets,
+    get_buckets,
+    refill,
+)
+from backend.demo.model.message import Message
+from backend.model.rate_limit import RateLimitBucket
+
+
+# Runs the database buckets within the test transaction
+class SessionEngine:
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+
+    @contextlib.contextmanager
+    def begin(self) -> Generator[Connection, None, None]:
+        with self.connection.begin_nested():
+            yield self.connection
+
+
+@pytest.fixture
+def rate_limit(
+    app: Flask,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_STORAGE', 'shared')
+    monkeypatch.setitem(
+        app.config,
+        'RATE_LIMIT_SHARED_PATH',
+        str(tmp_path / 'buckets'),
+    )
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_MESSAGES_BURST', 2)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_MESSAGES_RATE', .5)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_FILES_BURST', 1)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_FILES_RATE', .1)
+    monkeypatch.setitem(app.extensions, 'rate_limit_buckets', {})
+
+
+def test_rate_limit_messages(
+    test_client: FlaskClient,
+    user_session: None,
+    rate_limit: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    before_count = Message.query.count()
+
+    for _ in range(2):
+        response = test_client.post('/messages', json={'text': 'Spam'})
+        assert response.status_code == 201
+
+    response = test_client.post('/messages/batch', json={'messages': [
+        {'text': 'More spam'},
+    ]})
+    assert response.status_code == 429
+    assert response.json == {'message': 'rate_limited'}
+    assert response.headers['Retry-After'] == '2'
+    assert Message.query.count() == before_count + 2
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 2)
+    response = test_client.post('/messages', json={'text': 'Patient'})
+    assert response.status_code == 201
+    response = test_client.post('/messages', json={'text': 'Spam'})
+    assert response.status_code == 429
+
+
+def test_rate_limit_messages_batch(
+    test_client: FlaskClient,
+    user_session: None,
+    rate_limit: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+    def post_batch(size: int) -> int:
+        return test_client.post('/messages/batch', json={'messages': [
+            {'text': 'Spam'},
+        ] * size}).status_code
+
+    # Charged a token per message
+    assert post_batch(2) == 201
+    response = test_client.post('/messages', json={'text': 'Spam'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+
+    monkeypatch.setattr(time, 'time', lambda: now + 2)
+    assert post_batch(2) == 429
+    assert post_batch(1) == 201
+
+    # Larger than the burst, leaving the bucket in debt
+    monkeypatch.setattr(time, 'time', lambda: now + 10)
+    assert post_batch(5) == 201
+    response = test_client.post('/messages', json={'text': 'Spam'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '8'
+
+
+def test_rate_limit_keys(
+    test_client: FlaskClient,
+    user_session: None,
+    rate_limit: None,
+) -> None:
+    for _ in range(2):
+        response = test_client.post('/messages', json={'text': 'Spam'})
+        assert response.status_code == 201
+
+    # Same user from elsewhere
+    response = test_client.post(
+        '/messages',
+        json={'text': 'Spam'},
+        environ_base={'REMOTE_ADDR': '192.0.2.1'},
+    )
+    assert response.status_code == 429
+
+    # Someone else from the same address
+    with test_client.session_transaction() as session:
+        del session['user_id']
+        session['admin'] = True
+
+    response = test_client.post('/messages', json={'text': 'Spam'})
+    assert response.status_code == 429
+
+    response = test_client.post(
+        '/messages',
+        json={'text': 'Spam'},
+        environ_base={'REMOTE_ADDR': '192.0.2.1'},
+    )
+    assert response.status_code == 201
+
+
+def test_rate_limit_files(
+    app: Flask,
+    test_client: FlaskClient,
+    admin_session: None,
+    rate_limit: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    response = test_client.post('/files')
+    assert response.status_code == 400
+
+    # Rejected before reading the upload
+    response = test_client.post(
+        '/files',
+        data={'file': (BytesIO(b'not-a-real-file'), 'file.bin')},
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '10'
+
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_FILES_BURST', 0)
+    response = test_client.post('/files')
+    assert response.status_code == 400
+
+
+def test_shared_buckets(tmp_path: Path) -> None:
+    # Like two workers of a node
+    buckets = SharedBuckets(str(tmp_path / 'buckets'), 16)
+    other_buckets = SharedBuckets(str(tmp_path / 'buckets'), 16)
+    assert buckets.take(['a'], 2, 1) == 0
+    assert other_buckets.take(['a'], 2, 1) == 0
+    assert buckets.take(['a', 'b'], 2, 1) == pytest.approx(1, abs=.1)
+    # All or nothing
+    assert other_buckets.take(['b'], 2, 1) == 0
+    assert other_buckets.take(['b'], 2, 1) == 0
+    assert other_buckets.take(['b'], 2, 1) == pytest.approx(1, abs=.1)
+    assert other_buckets.take(['c'], 2, 1, 3) == 0
+    assert other_buckets.take(['c'], 2, 1) == pytest.approx(2, abs=.1)
+
+
+def test_shared_buckets_threads(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    buckets = SharedBuckets(str(tmp_path / 'buckets'), 16)
+    taken: list[bool] = []
+
+    def slow_refill(*args: float) -> float:
+        # Switch threads between reading and writing buckets
+        time.sleep(.0001)
+        return refill(*args)
+
+    monkeypatch.setattr(rate_limit_module, 'refill', slow_refill)
+
+    def take() -> None:
+        for _ in range(20):
+            taken.append(buckets.take(['a'], 50, 1e-9) == 0)
+
+    threads = [threading.Thread(target=take) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # Never spent twice
+    assert taken.count(True) == 50
+
+
+def test_database_buckets(db_session: scoped_session[Session]) -> None:
+    connection = db_session.connection()
+    buckets = DatabaseBuckets(cast(Engine, SessionEngine(connection)))
+    assert buckets.take(['a', 'b'], 2, .5) == 0
+    assert buckets.take(['a'], 2, .5) == 0
+    # All or nothing
+    assert buckets.take(['a', 'b'], 2, .5) == 2
+    assert buckets.take(['b'], 2, .5) == 0
+    assert buckets.take(['b'], 2, .5) == 2
+
+    connection.execute(
+        update(RateLimitBucket)
+        .where(RateLimitBucket.key == 'a')
+        .values(update_time=RateLimitBucket.update_time - 2)
+    )
+    assert buckets.take(['a'], 2, .5) == 0
+    assert buckets.take(['a'], 2, .5) == 2
+    assert buckets.take(['c'], 2, .5, 2) == 0
+    assert buckets.take(['c'], 2, .5, 2) == 4
+
+
+def test_get_buckets(
+    app: Flask,
+    rate_limit: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    with app.app_context():
+        buckets = get_buckets()
+        assert isinstance(buckets, SharedBuckets)
+        assert get_buckets() is buckets
+
+        monkeypatch.setitem(app.config, 'RATE_LIMIT_STORAGE', 'database')
+        assert isinstance(get_buckets(), DatabaseBuckets)
+
+        monkeypatch.setitem(app.config, 'RATE_LIMIT_STORAGE', '')
+        assert get_buckets() is None
+
+        monkeypatch.setitem(app.config, 'RATE_LIMIT_STORAGE', 'redis')
+
+        with pytest.raises(ValueError, match='Unknown RATE_LIMIT_STORAGE'):
+            get_buckets()
@@ -2,63 +2,137 @@ export interface Message {
   id: string
   date: string
   author: string
+  channel: string
   text: string
 }
 
 // FIXME: See if this could be simplified using advice from https://nuxt.com/docs/getting-started/data-fetching#consuming-sse-server-sent-events-via-post-request
-export default async function() {
+export default async function(channel = 'general') {
   const { $api } = useNuxtApp()
   const messages = ref<Message[]>([])
   let stream: ReadableStream
   let reader: ReadableStreamDefaultReader<Uint8Array>
+  let mounted = true
+  let timeout: ReturnType<typeof setTimeout> | undefined
 
   onMounted(async () => {
-    stream = await $api<typeof stream>('/messages', {
-      responseType: 'stream',
-    })
-    reader = stream.getReader()
-    const decoder = new TextDecoder()
+    const EVENT_PREFIX = 'event: '
     const DATA_PREFIX = 'data: '
+    const ID_PREFIX = 'id: '
+    const RETRY_PREFIX = 'retry: '
+    // Until the server sends its own, like EventSource
+    let retry = 3000
+    let lastEventId = ''
 
-    while (true) {
-      let result: ReadableStreamReadResult<Uint8Array>
+    while (mounted) {
+      stream = await $api<typeof stream>('/messages', {
+        // Resume after the last message received instead of the backlog
+        headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+        // Bursts of messages come as a single array
+        query: { batch: true, channel },
+        responseType: 'stream',
+      })
 
-      try {
-        result = await reader.read()
+      if (!mounted) {
+        await stream.cancel()
+        break
       }
-      catch(error) {
-        if (
-          !(error instanceof TypeError)
-          || error.message !== 'Releasing lock'
-        ) {
+
+      reader = stream.getReader()
+      const decoder = new TextDecoder()
+      let event = 'created'
+      // Frames can be split across reads, batches especially
+      let buffer = ''
+
+      while (true) {
+        let result: ReadableStreamReadResult<Uint8Array>
+
+        try {
+          result = await reader.read()
+        }
+        catch(error) {
+          if (
+            !(error instanceof TypeError)
+            || error.message !== 'Releasing lock'
+          ) {
+            reader.releaseLock()
+          }
+          break
+        }
+
+        if (result.done) {
           reader.releaseLock()
+          break
         }
-        break
-      }
 
-      if (result.done) {
-        reader.releaseLock()
-        break
-      }
+        buffer += decoder.decode(result.value, { stream: true })
+        const lines = buffer.split('\n')
+        // Incomplete until its newline is read
+        buffer = lines.pop() ?? ''
+
+        for (const line of lines) {
+          if (line.startsWith(EVENT_PREFIX)) {
+            event = line.slice(EVENT_PREFIX.length)
+            continue
+          }
+
+          if (line.startsWith(ID_PREFIX)) {
+            lastEventId = line.slice(ID_PREFIX.length)
+            continue
+          }
+
+          if (line.startsWith(RETRY_PREFIX)) {
+            const value = Number(line.slice(RETRY_PREFIX.length))
 
-      const data = decoder.decode(result.value)
+            if (Number.isInteger(value) && value >= 0) {
+              retry = value
+            }
+            continue
+          }
 
-      for (const line of data.split('\n')) {
-        if (!line.startsWith(DATA_PREFIX)) {
-          continue
+          if (!line.startsWith(DATA_PREFIX)) {
+            continue
+          }
+
+          const payload = JSON.parse(line.slice(DATA_PREFIX.length))
+
+          if (event === 'updated') {
+            const index = messages.value.findIndex(
+              message => message.id === payload.id,
+            )
+
+            if (index !== -1) {
+              messages.value[index] = payload
+            }
+          }
+          else if (event === 'deleted') {
+            messages.value = messages.value.filter(
+              message => message.id !== payload.id,
+            )
+          }
+          else if (event === 'created') {
+            messages.value.push(...payload)
+          }
         }
+      }
 
-        messages.value.push(JSON.parse(line.slice(DATA_PREFIX.length)))
+      // The server ends the stream of slow clients, reconnect like
+      // EventSource would
+      if (mounted) {
+        await new Promise(resolve => (timeout = setTimeout(resolve, retry)))
       }
     }
   })
 
   onUnmounted(async () => {
+    mounted = false
+    clearTimeout(timeout)
     reader?.releaseLock()
     await stream?.cancel()
   })
 
   return {
-    data: messages
+    data: messages,
+    channel,
   }
 }
@@ -1,8 +1,16 @@
-export async function sendMessage(message: string) {
+export async function sendMessage(message: string, channel?: string) {
   const { $api } = useNuxtApp()
   return $api<{ id: string }>('/messages', {
     method: 'POST',
-    body: { text: message },
+    body: { text: message, channel },
+  })
+}
+
+export async function sendMessages(messages: string[], channel?: string) {
+  const { $api } = useNuxtApp()
+  return $api<{ ids: string[] }>('/messages/batch', {
+    method: 'POST',
+    body: { messages: messages.map(text => ({ text, channel })) },
   })
 }
 
@@ -10,3 +18,43 @@ export async function deleteMessage(id: string) {
   const { $api } = useNuxtApp()
   return $api<''>(`/messages/${id}`, { method: 'DELETE' })
 }
+
+export async function getMessageHistory(
+  before?: string,
+  limit?: number,
+  channel?: string,
+) {
+  const { $api } = useNuxtApp()
+  return $api<{ messages: Message[], before: string | null }>(
+    '/messages/history',
+    { query: { before, limit, channel } },
+  )
+}
+
+export async function searchMessages(
+  q: string,
+  after?: string,
+  limit?: number,
+  channel?: string,
+) {
+  const { $api } = useNuxtApp()
+  return $api<{
+    messages: (Message & { rank: number, snippet: string })[]
+    after: string | null
+  }>('/messages/search', { query: { q, after, limit, channel } })
+}
+
+export async function deleteMessages(
+  filter: {
+    author?: string,
+    channel?: string,
+    since?: string,
+    until?: string,
+  },
+) {
+  const { $api } = useNuxtApp()
+  return $api<{ ids: string[] }>('/messages', {
+    method: 'DELETE',
+    query: filter,
+  })
+}